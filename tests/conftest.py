@@ -0,0 +1,33 @@
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'xcp-final-project4.py')
+
+
+def load_tool():
+    # The script name is not importable, load it by path
+    spec = importlib.util.spec_from_file_location('xcp_tool', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+xcp_tool = load_tool()
+
+
+@pytest.fixture
+def xcp():
+    return xcp_tool
+
+
+@pytest.fixture
+def tool(xcp):
+    # An XCPToolGUI without a window: only what the tested methods use is set up
+    app = xcp.XCPToolGUI.__new__(xcp.XCPToolGUI)
+    app.log_lines = []
+    app.update_log = app.log_lines.append
+    app.suffixes = list(xcp.XCPToolGUI.DEFAULT_SUFFIXES)
+    app.rebuild_suffix_matcher()
+    return app
@@ -0,0 +1,33 @@
+"""ExportCollator: streaming append and schema widening."""
+import pandas as pd
+
+
+def write(path, rows):
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return str(path)
+
+
+def test_new_column_widens_rows_collated_so_far(xcp, tmp_path):
+    first = write(tmp_path / 'a.csv', {'ASIN': ['B1', 'B2'], 'Status ': ['ok', 'ok']})
+    second = write(tmp_path / 'b.csv', {'ASIN': ['B3'], 'Reason': ['missing']})
+    collator = xcp.ExportCollator(str(tmp_path / 'all.csv'), sanitize=str.strip, chunksize=1)
+    assert collator.add(first, 'Class A', 'US') == 2
+    assert collator.add(second, 'Class B', None) == 1
+    assert collator.add(first) == 0
+    output = collator.finalize()
+    df = pd.read_csv(output, dtype=str, keep_default_na=False)
+    assert list(df.columns) == ['ASIN', 'Status', 'source_file', 'Reason']
+    assert df.to_dict('records') == [
+        {'ASIN': 'B1', 'Status': 'ok', 'source_file': 'a.csv', 'Reason': ''},
+        {'ASIN': 'B2', 'Status': 'ok', 'source_file': 'a.csv', 'Reason': ''},
+        {'ASIN': 'B3', 'Status': '', 'source_file': 'b.csv', 'Reason': 'missing'},
+    ]
+    assert collator.rows == 3
+    assert collator.sources == {'a.csv': ('Class A', 'US'), 'b.csv': ('Class B', None)}
+
+
+def test_finalize_without_exports(xcp, tmp_path):
+    (tmp_path / 'all.csv.part').write_text("stale")
+    collator = xcp.ExportCollator(str(tmp_path / 'all.csv'), sanitize=str.strip)
+    assert collator.finalize() is None
+    assert not (tmp_path / 'all.csv').exists()
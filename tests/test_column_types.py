@@ -0,0 +1,33 @@
+"""infer_column_types over chunked, text-only CSVs."""
+import pandas as pd
+
+
+def test_types_are_inferred_across_chunks(xcp, tmp_path):
+    path = tmp_path / 'export.csv'
+    pd.DataFrame({
+        'count': ['1', '2', '', '40'],
+        'price': ['1', '2.5', '3', ''],
+        'asin': ['0123456789', '1234567890', '2345678901', '3456789012'],
+        'flag': ['Yes', 'no', 'TRUE', 'false'],
+        'status': ['ok', 'ok', 'ok', 'failed'],
+        'note': ['a', 'b', 'c', 'd'],
+    }).to_csv(path, index=False)
+    assert xcp.infer_column_types(str(path), chunksize=2) == {
+        'count': 'int',
+        'price': 'float',
+        # A zero-padded value in the first chunk keeps the whole column text
+        'asin': 'string',
+        'flag': 'bool',
+        'status': 'category',
+        'note': 'string',
+    }
+
+
+def test_category_limit_and_always_categorical(xcp, tmp_path):
+    path = tmp_path / 'export.csv'
+    pd.DataFrame({
+        'class_name': ['A', 'B', 'C', 'D'],
+        'status': ['x', 'y', 'z', 'x'],
+    }).to_csv(path, index=False)
+    types = xcp.infer_column_types(str(path), category_limit=2, always_categorical=('class_name',))
+    assert types == {'class_name': 'category', 'status': 'string'}
@@ -0,0 +1,47 @@
+"""BackendGovernor token bucket, leases and AIMD in-flight limit."""
+
+
+def governor(xcp, tmp_path, **limits):
+    return xcp.BackendGovernor(path=str(tmp_path / 'governor.sqlite'), limits={'test': limits}, target_latency=60.0)
+
+
+def test_token_bucket_limits_the_burst(xcp, tmp_path):
+    gov = governor(xcp, tmp_path, rate_per_min=6, burst=2, max_in_flight=10)
+    first, _ = gov._try_acquire('test')
+    second, _ = gov._try_acquire('test')
+    assert first is not None and second is not None
+    lease_id, wait = gov._try_acquire('test')
+    assert lease_id is None
+    # One token per 10 seconds at 6 per minute
+    assert 9 < wait <= 10
+    gov.close()
+
+
+def test_in_flight_limit_and_release(xcp, tmp_path):
+    gov = governor(xcp, tmp_path, burst=10, max_in_flight=1)
+    lease_id, _ = gov._try_acquire('test')
+    assert gov._try_acquire('test') == (None, 1.0)
+    gov.release(lease_id)
+    assert gov._try_acquire('test')[0] is not None
+    gov.close()
+
+
+def test_expired_leases_free_their_slot(xcp, tmp_path):
+    gov = governor(xcp, tmp_path, burst=10, max_in_flight=1, lease_seconds=-1)
+    assert gov._try_acquire('test')[0] is not None
+    assert gov._try_acquire('test')[0] is not None
+    gov.close()
+
+
+def test_aimd_halves_once_per_window_and_recovers(xcp, tmp_path):
+    gov = governor(xcp, tmp_path, max_in_flight=4)
+    gov.release(gov._try_acquire('test')[0])
+    assert gov.observe('test', 90) == 2
+    # Further slow calls in the same window are the same spike
+    assert gov.observe('test', 90) == 2
+    assert gov.observe('test', 5) == 2.5
+    assert gov.observe('test', 5) == 2.9
+    for _ in range(10):
+        limit = gov.observe('test', 5)
+    assert limit == 4
+    gov.close()
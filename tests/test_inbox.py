@@ -0,0 +1,20 @@
+"""Job order and bookkeeping of InboxWatcher."""
+import os
+
+
+def test_inbox_watcher_orders_jobs_by_priority_once_stable(xcp, tmp_path):
+    watcher = xcp.InboxWatcher(str(tmp_path))
+    for name in ('normal.xlsx', os.path.join('low', 'later.xlsx'), os.path.join('high', 'urgent.xlsx'), '~$normal.xlsx'):
+        (tmp_path / name).write_text('x')
+    # Files are queued on the second scan that sees the same size
+    assert watcher.scan() == 0
+    assert watcher.scan() == 3
+    order = [watcher.next_job() for _ in range(3)]
+    assert [(priority, os.path.basename(file)) for priority, file in order] == [
+        ('high', 'urgent.xlsx'), ('normal', 'normal.xlsx'), ('low', 'later.xlsx'),
+    ]
+    assert watcher.next_job() is None
+    # Queued files are not picked up again until they are finished
+    assert watcher.scan() == 0
+    watcher.finish(order[0][1], ok=True)
+    assert (tmp_path / 'done' / 'urgent.xlsx').exists()
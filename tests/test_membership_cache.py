@@ -0,0 +1,26 @@
+"""MembershipCache lookups and expiry."""
+
+
+def test_lookup_returns_fresh_entries(xcp, tmp_path):
+    cache = xcp.MembershipCache(path=str(tmp_path / 'membership.db'))
+    cache.store('FS', ['A', 'B'], {'A'})
+    found = cache.lookup('FS', ['A', 'B', 'C'])
+    assert dict(zip(found['asin'], found['is_member'])) == {'A': 1, 'B': 0}
+    assert cache.lookup('SNS', ['A']).empty
+    cache.close()
+
+
+def test_expired_entries_are_unknown_and_pruned(xcp, tmp_path, monkeypatch):
+    path = str(tmp_path / 'membership.db')
+    cache = xcp.MembershipCache(path=path, ttl_days=1)
+    now = xcp.time.time()
+    monkeypatch.setattr(xcp.time, 'time', lambda: now - 2 * 86400)
+    cache.store('FS', ['OLD'], {'OLD'})
+    monkeypatch.setattr(xcp.time, 'time', lambda: now)
+    cache.store('FS', ['NEW'], set())
+    assert list(cache.lookup('FS', ['OLD', 'NEW'])['asin']) == ['NEW']
+    cache.close()
+
+    cache = xcp.MembershipCache(path=path, ttl_days=1)
+    assert [row[0] for row in cache.conn.execute("SELECT asin FROM membership")] == ['NEW']
+    cache.close()
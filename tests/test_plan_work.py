@@ -0,0 +1,28 @@
+"""Batch planning in plan_work."""
+import pandas as pd
+
+
+def test_plan_work_splits_batches_per_marketplace(tool):
+    df = pd.DataFrame({
+        'Class': ['Foo'] * 5,
+        'asin_id': [f'B00ABCDEF{i}' for i in range(5)],
+        'marketplace_id': ['US', 'US', 'US', 'CA', None],
+    })
+    plan = tool.plan_work(tool.preflight_check(df, 'Class'), 'Class', batch_size=2)
+    assert len(plan) == 1
+    batches = plan[0][1]
+    # Where the blank marketplace group sorts is up to pandas
+    assert sorted(((marketplace or '', num, total, len(asins)) for marketplace, num, total, asins in batches)) == [
+        ('', 1, 1, 1), ('CA', 1, 1, 1), ('US', 1, 2, 2), ('US', 2, 2, 1),
+    ]
+
+
+def test_plan_work_starts_each_class_on_the_last_marketplace(tool):
+    df = pd.DataFrame({
+        'Class': ['A', 'A', 'B', 'B'],
+        'asin_id': ['B00ABCDEF1', 'B00ABCDEF2', 'B00ABCDEF3', 'B00ABCDEF4'],
+        'marketplace_id': ['CA', 'US', 'US', 'UK'],
+    })
+    plan = tool.plan_work(tool.preflight_check(df, 'Class'), 'Class')
+    marketplaces = [batch[0] for _, batches in plan for batch in batches]
+    assert marketplaces == ['CA', 'US', 'US', 'UK']
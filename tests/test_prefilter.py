@@ -0,0 +1,113 @@
+"""Program pre-filter: filter_batches and the failure path of prefilter_memberships."""
+import asyncio
+import sqlite3
+from collections import Counter
+
+import pytest
+
+
+def test_filter_batches_renumbers_per_marketplace(xcp):
+    batches = [
+        ('US', 1, 3, ['A', 'B']),
+        ('US', 2, 3, ['C']),
+        ('US', 3, 3, ['D']),
+        ('CA', 1, 1, ['E']),
+    ]
+    assert xcp.filter_batches(batches, {'B', 'C', 'E'}) == [
+        ('US', 1, 2, ['A']),
+        ('US', 2, 2, ['D']),
+    ]
+
+
+WORK_PLAN = [
+    ('A', [('US', 1, 1, ['B00000000A', 'B00000000B', 'B00000000C'])]),
+    ('B', [('US', 1, 1, ['B00000000D'])]),
+    ('C', [(None, 1, 1, ['B00000000E'])]),
+]
+
+
+class BrokenCache:
+    def lookup(self, program, asins):
+        raise sqlite3.OperationalError("database is locked")
+
+    def close(self):
+        pass
+
+
+class NoPagesContext:
+    async def new_page(self):
+        raise RuntimeError("Target closed")
+
+
+@pytest.fixture
+def prefilter_tool(tool, xcp):
+    tool.metrics = xcp.RunMetrics(len(WORK_PLAN), 5)
+    tool.membership_counts = Counter()
+    tool.is_processing = True
+    tool.draining = False
+    return tool
+
+
+def run_prefilter(tool, context):
+    async def run():
+        tool.work_ready = asyncio.Event()
+        work_queue = []
+        await tool.prefilter_memberships(context, 'FS', WORK_PLAN, work_queue, '.')
+        return work_queue
+    return asyncio.run(run())
+
+
+def test_failed_cache_lookup_queues_every_class_unfiltered(prefilter_tool):
+    prefilter_tool.open_membership_cache = BrokenCache
+    queue = run_prefilter(prefilter_tool, NoPagesContext())
+    assert [(item['class_name'], item['batches']) for item in queue] == WORK_PLAN
+
+
+def test_failure_partway_through_the_plan_queues_the_rest(prefilter_tool):
+    prefilter_tool.open_membership_cache = lambda: None
+    # The first chunk fills up inside class A and cannot open its page
+    prefilter_tool.MEMBERS_CHUNK_SIZE = 2
+    queue = run_prefilter(prefilter_tool, NoPagesContext())
+    assert [(item['class_name'], item['batches']) for item in queue] == WORK_PLAN
+    assert any("pre-filter failed" in line for line in prefilter_tool.log_lines)
+
+
+class RecordingCache:
+    def __init__(self):
+        self.stored = []
+
+    def lookup(self, program, asins):
+        import pandas as pd
+        return pd.DataFrame({'asin': [], 'is_member': []})
+
+    def store(self, program, asins, members):
+        self.stored.append(list(asins))
+
+    def close(self):
+        pass
+
+
+class OpenPage:
+    def is_closed(self):
+        return False
+
+    async def close(self):
+        pass
+
+
+class OnePageContext:
+    async def new_page(self):
+        return OpenPage()
+
+
+def test_failed_chunk_is_not_cached(prefilter_tool, xcp):
+    cache = RecordingCache()
+    prefilter_tool.open_membership_cache = lambda: cache
+
+    async def failing_step(name, action, page=None, recover=None, policy=None):
+        raise xcp.StepError("Membership export has no 'isMember' or 'ASIN' column.", xcp.FAULT_DOWNLOAD)
+
+    prefilter_tool.run_step = failing_step
+    queue = run_prefilter(prefilter_tool, OnePageContext())
+    assert cache.stored == []
+    assert [(item['class_name'], item['batches']) for item in queue] == WORK_PLAN
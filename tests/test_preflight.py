@@ -0,0 +1,53 @@
+"""Input normalization in preflight_check. Runs without a browser or a window."""
+import pandas as pd
+
+
+def test_preflight_normalizes_asins(tool):
+    df = pd.DataFrame({
+        'Class': ['Foo'] * 5,
+        'asin_id': [' b00abcdefg ', 123456789.0, '0123456789', None, 'TOO-SHORT'],
+    })
+    result = tool.preflight_check(df, 'Class')
+    # 123456789.0 is the Excel float of 0123456789 and collapses into the same ASIN
+    assert result['asin_id'].tolist() == ['B00ABCDEFG', '0123456789']
+
+
+def test_preflight_drops_duplicates_per_class_and_marketplace(tool):
+    df = pd.DataFrame({
+        'Class': ['Foo', 'Foo', 'Foo', 'Bar'],
+        'asin_id': ['B00ABCDEFG', 'B00ABCDEFG', 'B00ABCDEFG', 'B00ABCDEFG'],
+        'marketplace_id': ['US', 'us ', 'CA', 'US'],
+    })
+    result = tool.preflight_check(df, 'Class')
+    assert sorted(zip(result['Class'], result['marketplace_id'])) == [('Bar', 'US'), ('Foo', 'CA'), ('Foo', 'US')]
+
+
+def test_preflight_cleans_class_names_and_drops_missing_ones(tool):
+    df = pd.DataFrame({
+        'Class': ['Foo_US', ' Foo ', None, ''],
+        'asin_id': ['B00ABCDEFG', 'B00ABCDEFH', 'B00ABCDEFI', 'B00ABCDEFJ'],
+    })
+    result = tool.preflight_check(df, 'Class')
+    assert result['Class'].tolist() == ['Foo', 'Foo']
+
+
+def test_preflight_keeps_blank_marketplaces_and_drops_unknown_ones(tool):
+    df = pd.DataFrame({
+        'Class': ['Foo', 'Bar', 'Bar', 'Baz'],
+        'asin_id': ['B00ABCDEFG', 'B00ABCDEFG', 'B00ABCDEFH', 'B00ABCDEFI'],
+        'marketplace_id': ['US', None, ' ', 'XX'],
+    })
+    result = tool.preflight_check(df, 'Class')
+    assert result['Class'].tolist() == ['Foo', 'Bar', 'Bar']
+    assert result['marketplace_id'].isna().tolist() == [False, True, True]
+
+
+def test_preflight_all_blank_marketplaces(tool):
+    df = pd.DataFrame({
+        'Class': ['Foo', 'Foo'],
+        'asin_id': ['B00ABCDEFG', 'B00ABCDEFH'],
+        'marketplace_id': [None, None],
+    })
+    result = tool.preflight_check(df, 'Class')
+    assert len(result) == 2
+    assert tool.plan_work(result, 'Class') == [('Foo', [(None, 1, 1, ['B00ABCDEFG', 'B00ABCDEFH'])])]
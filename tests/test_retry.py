@@ -0,0 +1,44 @@
+"""Fault classification, RetryPolicy and CircuitBreaker."""
+
+import asyncio
+
+
+def test_classify_error(xcp):
+    assert xcp.classify_error(xcp.StepError("x", xcp.FAULT_DOWNLOAD)) == xcp.FAULT_DOWNLOAD
+    assert xcp.classify_error(xcp.ExportNotReadyError("late")) == xcp.FAULT_SELECTOR_TIMEOUT
+    assert xcp.classify_error(Exception("page.goto: net::ERR_CONNECTION_RESET")) == xcp.FAULT_NAVIGATION
+    assert xcp.classify_error(Exception("Download is starting")) == xcp.FAULT_DOWNLOAD
+    assert xcp.classify_error(Exception("Timeout 5000ms exceeded.")) == xcp.FAULT_SELECTOR_TIMEOUT
+    assert xcp.classify_error(ValueError("bad value")) == xcp.FAULT_UNKNOWN
+
+
+def test_auth_redirect_wins(xcp):
+    error = xcp.StepError("x", xcp.FAULT_DOWNLOAD)
+    assert xcp.classify_error(error, "https://midway-auth.amazon.com/login") == xcp.FAULT_AUTH_EXPIRED
+
+
+def test_retry_policy_budget_and_backoff(xcp):
+    policy = xcp.RetryPolicy(base_delay=1.0, max_delay=4.0, attempts={xcp.FAULT_DOWNLOAD: 5})
+    assert policy.attempts_for(xcp.FAULT_DOWNLOAD) == 5
+    assert policy.attempts_for('something_else') == policy.attempts_for(xcp.FAULT_UNKNOWN)
+    assert 0.5 <= policy.backoff(1) <= 1.0
+    assert 2.0 <= policy.backoff(10) <= 4.0
+
+
+def test_circuit_breaker_opens_and_half_opens(xcp):
+    async def scenario():
+        breaker = xcp.CircuitBreaker(threshold=3, cooldown=0.01)
+        assert not breaker.record_failure()
+        breaker.record_success()
+        assert [breaker.record_failure() for _ in range(3)] == [False, False, True]
+        assert breaker.is_open
+        assert not breaker.record_failure()
+        await asyncio.wait_for(breaker.wait(), 1)
+        assert not breaker.is_open
+        # Half open: the next failure reopens it straight away
+        assert breaker.record_failure()
+        await asyncio.wait_for(breaker.wait(), 1)
+        breaker.record_success()
+        assert breaker.failures == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+"""Learned step timeouts in TimeoutTuner."""
+
+
+def tuner(xcp, tmp_path, **kwargs):
+    return xcp.TimeoutTuner(path=str(tmp_path / 'latency.json'), **kwargs)
+
+
+def test_default_until_enough_samples(xcp, tmp_path):
+    timeouts = tuner(xcp, tmp_path, min_samples=20)
+    for _ in range(19):
+        timeouts.observe('class_link', 0.8)
+    assert timeouts.timeout('class_link') == 5000
+    timeouts.observe('class_link', 0.8)
+    # 0.8 s falls in the bucket up to 0.909 s, times the factor of 3
+    assert timeouts.timeout('class_link') == 2727
+
+
+def test_timeout_is_clamped_to_floor_and_ceiling(xcp, tmp_path):
+    timeouts = tuner(xcp, tmp_path)
+    for _ in range(50):
+        timeouts.observe('class_link', 0.05)
+        timeouts.observe('page_load', 500)
+    assert timeouts.timeout('class_link') == 2000
+    assert timeouts.timeout('page_load') == 60000
+
+
+def test_quantile_picks_the_bucket_bound(xcp, tmp_path):
+    timeouts = tuner(xcp, tmp_path, min_samples=1)
+    for seconds in [0.1] * 98 + [10, 10]:
+        timeouts.observe('test_button', seconds)
+    assert timeouts.quantile('test_button', 0.5) <= 0.1 * 1.25
+    assert 10 <= timeouts.quantile('test_button', 0.99) <= 10 * 1.25
+
+
+def test_occasional_timeouts_do_not_ratchet_the_timeout(xcp, tmp_path):
+    timeouts = tuner(xcp, tmp_path)
+    highest = 0
+    for _ in range(5):
+        for i in range(100):
+            if i % 33 == 0:
+                timeouts.timed_out('class_link')
+            else:
+                timeouts.observe('class_link', 0.8)
+            highest = max(highest, timeouts.timeout('class_link'))
+    # Back-to-back timeouts at most reach the back-off limit, never the 30 s ceiling
+    assert highest <= 2727 * xcp.TimeoutTuner.MAX_BACKOFF
+    timeouts.observe('class_link', 0.8)
+    assert timeouts.timeout('class_link') == 2727
+
+
+def test_timeouts_back_off_boundedly_until_a_success(xcp, tmp_path):
+    timeouts = tuner(xcp, tmp_path)
+    for _ in range(10):
+        timeouts.timed_out('test_button')
+    assert timeouts.timeout('test_button') == 5000 * xcp.TimeoutTuner.MAX_BACKOFF
+    timeouts.observe('test_button', 1)
+    assert timeouts.timeout('test_button') == 5000
+
+
+def test_history_is_saved_and_halved(xcp, tmp_path):
+    timeouts = tuner(xcp, tmp_path, max_samples=100)
+    for _ in range(101):
+        timeouts.observe('page_load', 1)
+    assert sum(timeouts.histograms['page_load']) == 50.5
+    timeouts.timed_out('page_load')
+    timeouts.save()
+    reloaded = tuner(xcp, tmp_path)
+    assert reloaded.histograms == timeouts.histograms
+    # The back-off only lasts for the session
+    assert reloaded.backoff == {}
+
+
+def test_history_with_other_buckets_is_ignored(xcp, tmp_path):
+    (tmp_path / 'latency.json').write_text('{"bounds": [1, 2], "steps": {"page_load": [1, 2, 3]}}')
+    assert tuner(xcp, tmp_path).histograms == {}
@@ -14,22 +14,27 @@ if getattr(sys, 'frozen', False):  # Running as compiled .exe
     browsers_path = os.path.join(exe_dir, 'ms-playwright')
     os.environ['PLAYWRIGHT_BROWSERS_PATH'] = browsers_path  # Ensures portable Playwright
 
+# Folder for files kept between runs (next to the .exe when frozen)
+APP_DIR = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(os.path.abspath(__file__))
+
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import filedialog, messagebox, Listbox
-import pandas as pd
+# pandas, playwright, pyautogui and nest_asyncio are imported where they are used,
+# so the window (and the command line) comes up without loading them
 import asyncio
-from playwright.async_api import async_playwright
-import nest_asyncio
 import logging
 import datetime
 import glob
-import pyautogui
 import time
 import re
-
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
+import random
+import json
+import sqlite3
+import argparse
+import heapq
+import threading
+from collections import Counter, deque
 
 # Configure logging
 logging.basicConfig(
@@ -38,7 +43,1432 @@ logging.basicConfig(
     filename='xcp_tool.log'
 )
 
+# User settings kept between sessions (suffix list, options)
+SETTINGS_FILE = os.path.join(APP_DIR, 'xcp_tool_settings.json')
+
+def load_settings():
+    """Returns the saved settings, or an empty dict if none were saved yet."""
+    try:
+        with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_settings(settings):
+    with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(settings, f, indent=2)
+
+class ExportNotReadyError(TimeoutError):
+    """Raised when the sample ASIN test results do not become exportable in time."""
+
+# Fault classes used to decide how a failed step is retried
+FAULT_SELECTOR_TIMEOUT = 'selector_timeout'
+FAULT_NAVIGATION = 'navigation_failure'
+FAULT_DOWNLOAD = 'download_failure'
+FAULT_AUTH_EXPIRED = 'auth_expired'
+FAULT_UNKNOWN = 'unknown'
+
+# URL fragments that mean the browser was sent to the SSO login
+AUTH_URL_MARKERS = ("SSO/redirect", "midway-auth.amazon.com")
+
+def is_auth_url(url):
+    return any(marker in (url or '') for marker in AUTH_URL_MARKERS)
+
+class StepError(Exception):
+    """An automation step that failed, tagged with its fault class."""
+
+    def __init__(self, message, fault=FAULT_UNKNOWN):
+        super().__init__(message)
+        self.fault = fault
+
+def classify_error(error, page_url=''):
+    """
+    Maps an exception raised by an automation step to one of the FAULT_* classes.
+    An auth redirect on the page wins over whatever the step itself reported.
+    """
+    if is_auth_url(page_url):
+        return FAULT_AUTH_EXPIRED
+    if isinstance(error, StepError):
+        return error.fault
+    if isinstance(error, ExportNotReadyError):
+        return FAULT_SELECTOR_TIMEOUT
+    message = str(error)
+    if 'net::ERR_' in message or 'page.goto' in message or 'page.reload' in message or 'navigat' in message.lower():
+        return FAULT_NAVIGATION
+    if 'download' in message.lower():
+        return FAULT_DOWNLOAD
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)) or 'Timeout' in type(error).__name__ or 'Timeout' in message:
+        return FAULT_SELECTOR_TIMEOUT
+    return FAULT_UNKNOWN
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter and an attempt budget per fault class.
+    Expired auth is not retried here; it needs a new login, not another attempt.
+    """
+
+    DEFAULT_ATTEMPTS = {
+        FAULT_SELECTOR_TIMEOUT: 3,
+        FAULT_NAVIGATION: 3,
+        FAULT_DOWNLOAD: 2,
+        FAULT_AUTH_EXPIRED: 1,
+        FAULT_UNKNOWN: 2,
+    }
+
+    def __init__(self, base_delay=1.0, max_delay=30.0, attempts=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = dict(self.DEFAULT_ATTEMPTS)
+        self.attempts.update(attempts or {})
+
+    def attempts_for(self, fault):
+        return self.attempts.get(fault, self.attempts[FAULT_UNKNOWN])
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive step failures and holds every worker for
+    `cooldown` seconds. After the cooldown one more failure reopens it straight away,
+    a success closes it.
+    """
+
+    def __init__(self, threshold=5, cooldown=60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.closed = asyncio.Event()
+        self.closed.set()
+
+    @property
+    def is_open(self):
+        return not self.closed.is_set()
+
+    async def wait(self):
+        await self.closed.wait()
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        """Returns True if this failure opened the breaker."""
+        self.failures += 1
+        if self.failures < self.threshold or self.is_open:
+            return False
+        self.closed.clear()
+        asyncio.get_running_loop().call_later(self.cooldown, self._half_open)
+        return True
+
+    def _half_open(self):
+        self.failures = self.threshold - 1
+        self.closed.set()
+
+class RunMetrics:
+    """
+    Live throughput for the dashboard: classes/min and ASINs/min over a rolling
+    window, an ETA from the ASINs still queued, and each worker's current step.
+    """
+
+    def __init__(self, total_classes=0, total_asins=0, window=600):
+        self.total_classes = total_classes
+        self.total_asins = total_asins
+        self.window = window
+        self.started = time.monotonic()
+        self.done_classes = 0
+        self.done_asins = 0
+        self.skipped_asins = 0
+        self.skipped_batches = 0
+        # (timestamp, asins, classes) completions inside the rolling window
+        self.events = deque()
+        self.worker_steps = {}
+
+    def set_worker_step(self, worker, step):
+        self.worker_steps[worker] = step
+
+    def record_batch(self, asins):
+        self.done_asins += asins
+        self.events.append((time.monotonic(), asins, 0))
+
+    def record_class(self):
+        self.done_classes += 1
+        self.events.append((time.monotonic(), 0, 1))
+
+    def skip_asins(self, asins, batches=0):
+        """ASINs that were given up on no longer count towards the ETA."""
+        self.skipped_asins += asins
+        self.skipped_batches += batches
+
+    def exclude(self, classes=0, asins=0):
+        """Work that turned out not to be needed, e.g. program members filtered out by the pre-filter."""
+        self.total_classes -= classes
+        self.total_asins -= asins
+
+    def rates(self):
+        """Returns (classes per minute, ASINs per minute) over the rolling window."""
+        now = time.monotonic()
+        while self.events and now - self.events[0][0] > self.window:
+            self.events.popleft()
+        minutes = max(min(self.window, now - self.started), 1.0) / 60
+        asins = sum(event[1] for event in self.events)
+        classes = sum(event[2] for event in self.events)
+        return classes / minutes, asins / minutes
+
+    @property
+    def remaining_asins(self):
+        return max(self.total_asins - self.done_asins - self.skipped_asins, 0)
+
+    def progress(self):
+        if not self.total_asins:
+            return 0.0
+        return min((self.done_asins + self.skipped_asins) / self.total_asins, 1.0)
+
+    def eta_seconds(self):
+        _, asins_per_min = self.rates()
+        if not asins_per_min:
+            return None
+        return self.remaining_asins / asins_per_min * 60
+
+class MetricsRegistry:
+    """
+    Process-wide counters, gauges and histograms rendered in the Prometheus text
+    format, for unattended runs to be scraped instead of parsing xcp_tool.log.
+    """
+
+    DEFAULT_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.help = {}
+        self.buckets = {}
+        # (name, ((label, value), ...)) -> value, or [bucket counts, sum, count] for histograms
+        self.series = {}
+
+    def describe(self, name, kind, text, buckets=None):
+        self.kinds[name] = kind
+        self.help[name] = text
+        if kind == 'histogram':
+            self.buckets[name] = tuple(buckets or self.DEFAULT_BUCKETS)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.series[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets[name]
+        with self.lock:
+            counts, total, count = self.series.get(key, ([0] * len(buckets), 0.0, 0))
+            # Counts are kept cumulative, as the text format expects
+            counts = [bucket_count + (value <= bound) for bucket_count, bound in zip(counts, buckets)]
+            self.series[key] = (counts, total + value, count + 1)
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = []
+        with self.lock:
+            series = sorted(self.series.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            for name in sorted(self.kinds):
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.kinds[name]}")
+                for (series_name, pairs), value in series:
+                    if series_name != name:
+                        continue
+                    if self.kinds[name] != 'histogram':
+                        lines.append(f"{name}{self._labels(pairs)} {value}")
+                        continue
+                    counts, total, count = value
+                    for bound, bucket_count in zip(self.buckets[name], counts):
+                        lines.append(f"{name}_bucket{self._labels(pairs + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._labels(pairs + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self._labels(pairs)} {total}")
+                    lines.append(f"{name}_count{self._labels(pairs)} {count}")
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+METRICS.describe('xcp_classes_done_total', 'counter', "Classes finished (including ones with given up batches).")
+METRICS.describe('xcp_batches_done_total', 'counter', "Batches tested and exported.")
+METRICS.describe('xcp_batches_failed_total', 'counter', "Batches that still failed after retries.")
+METRICS.describe('xcp_asins_done_total', 'counter', "ASINs in exported batches.")
+METRICS.describe('xcp_retries_total', 'counter', "Failed step attempts by fault class.")
+METRICS.describe('xcp_step_seconds', 'histogram', "Duration of the steps of a batch.")
+METRICS.describe('xcp_download_bytes', 'histogram', "Size of the downloaded exports.",
+                 buckets=(16000, 64000, 256000, 1000000, 4000000, 16000000, 64000000))
+METRICS.describe('xcp_browser_js_heap_bytes', 'gauge', "Used JS heap of the automation page.")
+METRICS.describe('xcp_selector_lookups_total', 'counter', "Page element lookups by selector strategy and result.")
+METRICS.describe('xcp_governor_in_flight_limit', 'gauge', "Current AIMD in-flight limit of the backend governor.")
+METRICS.describe('xcp_governor_wait_seconds_total', 'counter', "Time spent waiting for a governor slot.")
+METRICS.describe('xcp_step_timeout_ms', 'gauge', "Timeout currently used per step.")
+METRICS.describe('xcp_run_active', 'gauge', "1 while a run is going.")
+METRICS.describe('xcp_run_progress_ratio', 'gauge', "Share of the run's ASINs done or given up.")
+METRICS.describe('xcp_asins_remaining', 'gauge', "ASINs still queued in the current run.")
+
+class MetricsServer:
+    """Serves METRICS on /metrics and the current run's summary on /summary from a daemon thread."""
+
+    def __init__(self, registry, summary, port, host='127.0.0.1'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] == '/metrics':
+                    body = registry.render().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path.split('?')[0] == '/summary':
+                    try:
+                        body = json.dumps(summary(), indent=2, default=str).encode('utf-8')
+                    except Exception as e:
+                        self.send_error(503, str(e))
+                        return
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def latency_stats(values):
+    """count/median/p95/max of a list of durations in seconds, as used in the run summary."""
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'median': round(values[len(values) // 2], 3),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        'max': round(values[-1], 3),
+    }
+
+class SelectorRegistry:
+    """
+    Ranked locator strategies for each logical page element. All strategies are
+    waited for at once as one combined locator, so a UI change costs one fallback
+    lookup instead of the full timeout of every stale selector in every batch, and
+    the element is found as soon as it shows. The strategy that found the element
+    last time is checked first when telling which one matched. Hits and misses are
+    counted per (element, strategy).
+    """
+
+    def __init__(self, elements, preferred=None):
+        # element -> [(strategy name, selector), ...] in order of preference
+        self.elements = elements
+        self.preferred = {name: strategy for name, strategy in (preferred or {}).items() if name in elements}
+        self.stats = Counter()
+
+    def ranked(self, name):
+        preferred = self.preferred.get(name)
+        return sorted(self.elements[name], key=lambda strategy: strategy[0] != preferred)
+
+    async def resolve(self, page, name, timeout=5000):
+        """
+        Returns a locator for the first visible match of `name`, waiting up to
+        `timeout` ms for any strategy to match. Raises StepError, with
+        FAULT_SELECTOR_TIMEOUT when no strategy matches in time.
+        """
+        strategies = self.ranked(name)
+        combined = page.locator(strategies[0][1])
+        for _, selector in strategies[1:]:
+            combined = combined.or_(page.locator(selector))
+        try:
+            await combined.first.wait_for(state="visible", timeout=timeout)
+        except Exception as e:
+            fault = classify_error(e, page.url)
+            if fault == FAULT_SELECTOR_TIMEOUT:
+                self.stats[(name, '*', 'miss')] += 1
+                METRICS.inc('xcp_selector_lookups_total', element=name, strategy='*', result='miss')
+            raise StepError(f"Could not find {name.replace('_', ' ')} with any of {len(strategies)} selectors: {str(e)}", fault) from e
+        # Tell which strategy matched, for the stats and the next lookup
+        for strategy, selector in strategies:
+            locator = page.locator(selector).first
+            try:
+                visible = await locator.is_visible()
+            except Exception:
+                visible = False
+            if visible:
+                self.record_hit(name, strategy)
+                return locator
+        # The element went away again in between, let the caller's next action wait for it
+        return combined.first
+
+    def record_hit(self, name, strategy):
+        previous = self.preferred.get(name)
+        if previous and previous != strategy:
+            # The cached strategy stopped working, count it once and switch
+            self.stats[(name, previous, 'miss')] += 1
+            METRICS.inc('xcp_selector_lookups_total', element=name, strategy=previous, result='miss')
+            logging.info(f"Selector for {name} changed from '{previous}' to '{strategy}'")
+        self.preferred[name] = strategy
+        self.stats[(name, strategy, 'hit')] += 1
+        METRICS.inc('xcp_selector_lookups_total', element=name, strategy=strategy, result='hit')
+
+    def summary(self):
+        result = {}
+        for (name, strategy, outcome), count in sorted(self.stats.items()):
+            result.setdefault(name, {}).setdefault(strategy, {'hit': 0, 'miss': 0})[outcome] = count
+        return result
+
+class PagePool:
+    """
+    The page a worker runs batches on plus one standby page of the same context.
+    While a batch's test runs server-side, the standby page is brought up to the
+    next batch's 'New sample ASINs test' form in the background, and `take` swaps
+    it in when it holds the form of the class asked for.
+    """
+
+    def __init__(self, context, active):
+        self.context = context
+        self.active = active
+        self.standby = None
+        self.prefetch_class = None
+        self.prefetch_task = None
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, class_name, prepare):
+        """Starts `await prepare(standby_page, class_name)` unless it is already running for that class."""
+        if self.prefetch_task is not None:
+            if self.prefetch_class == class_name:
+                return
+            self.prefetch_task.cancel()
+        self.prefetch_class = class_name
+        self.prefetch_task = asyncio.ensure_future(self._prefetch(class_name, prepare))
+        # Failures are reported by take(), don't let asyncio warn about them
+        self.prefetch_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def _prefetch(self, class_name, prepare):
+        if self.standby is None or self.standby.is_closed():
+            self.standby = await self.context.new_page()
+        await prepare(self.standby, class_name)
+
+    async def take(self, class_name):
+        """Makes the standby page active and returns True if its form for `class_name` is ready."""
+        task, self.prefetch_task = self.prefetch_task, None
+        if task is None:
+            return False
+        if self.prefetch_class != class_name:
+            task.cancel()
+            self.misses += 1
+            return False
+        # asyncio.wait leaves a cancellation of the caller apart from one of the preload
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if task.cancelled():
+            self.misses += 1
+            return False
+        if task.exception() is not None:
+            logging.info(f"Preloading class {class_name} failed: {str(task.exception())}")
+            self.misses += 1
+            return False
+        self.active, self.standby = self.standby, self.active
+        self.hits += 1
+        return True
+
+    async def cancel(self):
+        task, self.prefetch_task = self.prefetch_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+
+    async def recycle(self, url):
+        """Closes both pages to free browser memory and opens a fresh active page on `url`."""
+        await self.cancel()
+        for page in (self.active, self.standby):
+            if page is not None and not page.is_closed():
+                await page.close()
+        self.standby = None
+        self.active = await self.context.new_page()
+        await self.active.goto(url)
+
+def filter_batches(batches, members):
+    """
+    Drops the ASINs in `members` from (marketplace_id, batch_num, total_batches, asins)
+    batches and renumbers the batches left per marketplace.
+    """
+    kept = [(batch[0], [asin for asin in batch[3] if asin not in members]) for batch in batches]
+    kept = [(marketplace_id, asins) for marketplace_id, asins in kept if asins]
+    totals = Counter(marketplace_id for marketplace_id, _ in kept)
+    numbers = Counter()
+    result = []
+    for marketplace_id, asins in kept:
+        numbers[marketplace_id] += 1
+        result.append((marketplace_id, numbers[marketplace_id], totals[marketplace_id], asins))
+    return result
+
+class FailureTracer:
+    """
+    Playwright tracing of the current work item only. Tracing runs for the whole
+    context, but every item gets its own trace chunk: the chunk is dropped when
+    the item succeeds and written to disk when it fails, so at most one item's
+    trace is ever held. Tracing errors switch the tracer off instead of failing
+    the item.
+    The recording cost (screenshots and DOM snapshots during the steps) is
+    measured by running every `sample_every`-th item with tracing stopped and
+    comparing the median durations of its browser-side steps with those of
+    traced items. The time spent starting and stopping chunks is counted apart.
+    """
+
+    # Steps timed by the browser, not by the server-side test run
+    MEASURED_STEPS = ('open_class', 'input_asins', 'export')
+
+    def __init__(self, context, sample_every=10):
+        self.context = context
+        self.sample_every = sample_every
+        self.enabled = False
+        self.recording = False
+        self.in_item = False
+        self.items = 0
+        self.untraced_items = 0
+        self.saved = 0
+        self.chunk_seconds = 0.0
+        # traced? -> step -> durations
+        self.step_seconds = {True: {}, False: {}}
+
+    async def _timed(self, action):
+        started = time.monotonic()
+        try:
+            await action()
+            return True
+        except Exception as e:
+            logging.warning(f"Tracing disabled after error: {str(e)}")
+            self.enabled = False
+            return False
+        finally:
+            self.chunk_seconds += time.monotonic() - started
+
+    async def _record(self, on):
+        if on != self.recording:
+            if on:
+                ok = await self._timed(lambda: self.context.tracing.start(screenshots=True, snapshots=True))
+            else:
+                ok = await self._timed(self.context.tracing.stop)
+            self.recording = on and ok
+        return self.recording == on
+
+    async def start(self):
+        self.enabled = True
+        await self._record(True)
+        return self.enabled
+
+    async def begin_item(self):
+        # An item that ended in an unexpected exception still has its chunk open
+        await self.end_item()
+        if not self.enabled:
+            return
+        self.items += 1
+        if self.items % self.sample_every == 0:
+            # Untraced sample item, a failure in it has no trace
+            if await self._record(False):
+                self.untraced_items += 1
+            return
+        if await self._record(True) and await self._timed(self.context.tracing.start_chunk):
+            self.in_item = True
+
+    async def end_item(self, path=None):
+        """Drops the item's trace, or saves it to `path` when given."""
+        if not self.in_item:
+            return None
+        self.in_item = False
+        if not await self._timed(lambda: self.context.tracing.stop_chunk(path=path)):
+            return None
+        if path:
+            self.saved += 1
+        return path
+
+    def observe_step(self, step, seconds):
+        if self.enabled and step in self.MEASURED_STEPS:
+            self.step_seconds[self.recording].setdefault(step, []).append(seconds)
+
+    async def stop(self):
+        if self.enabled:
+            self.in_item = False
+            await self._record(False)
+            self.enabled = False
+
+    def report(self):
+        import statistics
+        traced = untraced = 0.0
+        for step in self.MEASURED_STEPS:
+            with_trace = self.step_seconds[True].get(step)
+            without_trace = self.step_seconds[False].get(step)
+            if with_trace and without_trace:
+                traced += statistics.median(with_trace)
+                untraced += statistics.median(without_trace)
+        return {
+            'items': self.items,
+            'untraced_items': self.untraced_items,
+            'traces_saved': self.saved,
+            'chunk_seconds': round(self.chunk_seconds, 2),
+            # None until both traced and untraced items have been timed
+            'overhead_percent': round((traced - untraced) / untraced * 100, 1) if untraced else None,
+        }
+
+def write_csv_atomic(df, path):
+    """Writes `df` to `<path>.part` and moves it into place, so `path` is only ever a complete file."""
+    partial = path + '.part'
+    try:
+        df.to_csv(partial, index=False)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def remove_partial_files(directory):
+    """Deletes the `.part` files a stopped or crashed run left in `directory`. Returns how many."""
+    removed = 0
+    for file in glob.glob(os.path.join(directory, '*.part')):
+        try:
+            os.remove(file)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+class ExportCollator:
+    """
+    Appends finished export CSVs to one collated CSV as they arrive, reading and
+    writing in chunks so memory stays flat however many batches there are.
+    The output columns are the union of the export headers. If a later export
+    brings a new column, the rows collated so far are rewritten once, chunk by
+    chunk, with the wider header.
+    Rows go to `<output>.part` until finalize() moves the file into place.
+    """
+
+    def __init__(self, output_file, sanitize, chunksize=50000):
+        self.output_file = output_file
+        self.partial_file = output_file + '.part'
+        self.sanitize = sanitize
+        self.chunksize = chunksize
+        self.columns = []
+        self.collated = set()
+        self.rows = 0
+        # source_file -> (class_name, marketplace_id) for exports collated in this run
+        self.sources = {}
+        # A leftover partial file is rebuilt from the export files themselves
+        if os.path.exists(self.partial_file):
+            os.remove(self.partial_file)
+
+    def has(self, file):
+        return os.path.abspath(file) in self.collated
+
+    def read_columns(self, file):
+        import pandas as pd
+        header = pd.read_csv(file, nrows=0).columns
+        return [self.sanitize(str(col)) for col in header] + ['source_file']
+
+    def extend_schema(self, columns):
+        import pandas as pd
+        new_columns = [col for col in columns if col not in self.columns]
+        if not new_columns:
+            return
+        self.columns.extend(new_columns)
+        if os.path.exists(self.partial_file):
+            rewritten = self.partial_file + '.tmp'
+            first = True
+            for chunk in pd.read_csv(self.partial_file, chunksize=self.chunksize, dtype=str, keep_default_na=False):
+                chunk.reindex(columns=self.columns).to_csv(rewritten, mode='w' if first else 'a', header=first, index=False)
+                first = False
+            os.replace(rewritten, self.partial_file)
+
+    def add(self, file, class_name=None, marketplace_id=None):
+        """Appends one export file to the collated output. Returns the number of rows added."""
+        import pandas as pd
+        if self.has(file):
+            return 0
+        columns = self.read_columns(file)
+        self.extend_schema(columns)
+        added = 0
+        for chunk in pd.read_csv(file, chunksize=self.chunksize, dtype=str, keep_default_na=False):
+            chunk.columns = columns[:-1]
+            chunk['source_file'] = os.path.basename(file)
+            write_header = not os.path.exists(self.partial_file)
+            chunk.reindex(columns=self.columns).to_csv(self.partial_file, mode='a', header=write_header, index=False)
+            added += len(chunk)
+        self.collated.add(os.path.abspath(file))
+        self.sources[os.path.basename(file)] = (class_name, marketplace_id)
+        self.rows += added
+        return added
+
+    def finalize(self):
+        """Moves the collated rows to the output file. Returns its path, or None if nothing was collated."""
+        if not os.path.exists(self.partial_file):
+            return None
+        os.replace(self.partial_file, self.output_file)
+        return self.output_file
+
+def infer_column_types(csv_file, chunksize=50000, category_limit=1000, always_categorical=()):
+    """
+    Streams a text-only CSV once and picks a type per column: 'int', 'float',
+    'bool', 'category' (few distinct values) or 'string'.
+    """
+    import pandas as pd
+    stats = {}
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize, dtype=str, keep_default_na=False):
+        for col in chunk.columns:
+            stat = stats.setdefault(col, {'int': True, 'float': True, 'bool': True, 'values': set(), 'count': 0})
+            values = chunk[col][chunk[col] != '']
+            if values.empty:
+                continue
+            stat['count'] += len(values)
+            if stat['float'] and values.str.match(r'0\d').any():
+                # Zero-padded IDs (e.g. numeric ASINs) must stay text
+                stat['float'] = stat['int'] = False
+            if stat['float']:
+                numbers = pd.to_numeric(values, errors='coerce')
+                stat['float'] = not numbers.isna().any()
+                stat['int'] = stat['int'] and stat['float'] and bool((numbers % 1 == 0).all())
+            if stat['bool']:
+                stat['bool'] = bool(values.str.lower().isin(['true', 'false', 'yes', 'no']).all())
+            if stat['values'] is not None:
+                stat['values'].update(values.unique())
+                if len(stat['values']) > category_limit:
+                    stat['values'] = None
+    types = {}
+    for col, stat in stats.items():
+        if stat['count'] and stat['int']:
+            types[col] = 'int'
+        elif stat['count'] and stat['float']:
+            types[col] = 'float'
+        elif stat['count'] and stat['bool']:
+            types[col] = 'bool'
+        elif col in always_categorical or (stat['values'] is not None and len(stat['values']) <= max(1, stat['count'] // 2)):
+            types[col] = 'category'
+        else:
+            types[col] = 'string'
+    return types
+
+def write_parquet_dataset(csv_file, dataset_dir, sources, run_date, chunksize=50000):
+    """
+    Writes a collated CSV as a Parquet dataset partitioned by
+    run_date/marketplace/class_name, with typed columns and dictionary encoding
+    for repetitive text columns. `sources` maps source_file to (class_name, marketplace_id).
+    Needs pyarrow; raises ImportError if it is not installed. Returns the number of rows written.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    partition_cols = ['run_date', 'marketplace', 'class_name']
+    types = infer_column_types(csv_file, chunksize, always_categorical=('source_file',))
+    types = {col: kind for col, kind in types.items() if col not in partition_cols}
+    arrow_types = {
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'bool': pa.bool_(),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'string': pa.string(),
+    }
+    schema = pa.schema([pa.field(col, arrow_types[kind]) for col, kind in types.items()] +
+                       [pa.field(col, pa.string()) for col in partition_cols])
+    class_by_source = {source: meta[0] or 'unknown' for source, meta in sources.items()}
+    marketplace_by_source = {source: meta[1] or 'ALL' for source, meta in sources.items()}
+    rows = 0
+    for chunk_num, chunk in enumerate(pd.read_csv(csv_file, chunksize=chunksize, dtype=str, keep_default_na=False)):
+        for col, kind in types.items():
+            values = chunk[col].mask(chunk[col] == '')
+            if kind == 'int':
+                chunk[col] = pd.to_numeric(values).astype('Int64')
+            elif kind == 'float':
+                chunk[col] = pd.to_numeric(values).astype('float64')
+            elif kind == 'bool':
+                chunk[col] = values.str.lower().map({'true': True, 'yes': True, 'false': False, 'no': False}).astype('boolean')
+            elif kind == 'category':
+                chunk[col] = values.astype('category')
+        source = chunk['source_file'] if 'source_file' in chunk.columns else pd.Series('', index=chunk.index)
+        chunk['run_date'] = run_date
+        chunk['marketplace'] = source.astype(str).map(marketplace_by_source).fillna('ALL')
+        chunk['class_name'] = source.astype(str).map(class_by_source).fillna('unknown')
+        table = pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False)
+        pq.write_to_dataset(
+            table,
+            root_path=dataset_dir,
+            partition_cols=partition_cols,
+            basename_template=f"part-{run_date}-{chunk_num}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore',
+        )
+        rows += len(chunk)
+    return rows
+
+# Program membership seen on the members page, reused across runs
+MEMBERSHIP_DB_FILE = os.path.join(APP_DIR, 'xcp_membership.sqlite')
+
+class MembershipCache:
+    """
+    ASIN program membership keyed by (program, ASIN), with the time it was last
+    checked. Entries older than `ttl_days` are treated as unknown and pruned.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS membership (
+            program TEXT NOT NULL,
+            asin TEXT NOT NULL,
+            is_member INTEGER NOT NULL,
+            checked_at REAL NOT NULL,
+            PRIMARY KEY (program, asin)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_membership_checked ON membership (checked_at);
+    """
+
+    def __init__(self, path=MEMBERSHIP_DB_FILE, ttl_days=7):
+        self.ttl = ttl_days * 86400
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.SCHEMA)
+        with self.conn:
+            self.conn.execute("DELETE FROM membership WHERE checked_at < ?", (time.time() - self.ttl,))
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, program, asins):
+        """
+        Returns a DataFrame of (asin, is_member) for the ASINs with a fresh entry.
+        The ASINs are joined against the table in SQLite, not looked up one by one.
+        """
+        import pandas as pd
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (asin TEXT PRIMARY KEY) WITHOUT ROWID")
+            self.conn.execute("DELETE FROM lookup")
+            self.conn.executemany("INSERT OR IGNORE INTO lookup (asin) VALUES (?)", ((asin,) for asin in asins))
+        return pd.read_sql_query(
+            "SELECT m.asin, m.is_member FROM lookup l JOIN membership m ON m.program = ? AND m.asin = l.asin "
+            "WHERE m.checked_at >= ?",
+            self.conn,
+            params=(program, time.time() - self.ttl),
+        )
+
+    def store(self, program, asins, members):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO membership (program, asin, is_member, checked_at) VALUES (?, ?, ?, ?)",
+                ((program, asin, int(asin in members), now) for asin in asins),
+            )
+
+# Persistent Chromium profiles, one per worker
+PROFILES_DIR = os.path.join(APP_DIR, 'browser_profiles')
+
+def pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows, ask the kernel instead
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class BrowserProfile:
+    """
+    A Chromium user-data directory kept between runs, so the HTTP and code caches
+    of the CP Central bundle (and the SSO cookies) survive. A lock file holding
+    the owner's pid keeps two running tools from opening the same profile;
+    locks left behind by a crashed tool are taken over.
+    """
+
+    def __init__(self, name, root=PROFILES_DIR):
+        self.root = root
+        self.name = re.sub(r'[^A-Za-z0-9_-]+', '_', name).strip('_')
+        self.path = os.path.join(root, self.name)
+        self.lock_file = self.path + '.lock'
+        self.locked = False
+        self.existed = False
+
+    def acquire(self):
+        os.makedirs(self.root, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._lock_is_stale():
+                    return False
+                try:
+                    os.remove(self.lock_file)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            self.locked = True
+            self.existed = os.path.isdir(self.path)
+            return True
+        return False
+
+    def _lock_is_stale(self):
+        try:
+            with open(self.lock_file, 'r') as f:
+                pid = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return True
+        return pid != os.getpid() and not pid_alive(pid)
+
+    def release(self):
+        if not self.locked:
+            return
+        self.locked = False
+        if os.path.isdir(self.path):
+            # Marks the profile as used for prune_profiles
+            os.utime(self.path)
+        try:
+            os.remove(self.lock_file)
+        except FileNotFoundError:
+            pass
+
+    def reset(self):
+        """Deletes the profile's data, e.g. when Chromium can no longer open it."""
+        import shutil
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.existed = False
+
+def prune_profiles(root=PROFILES_DIR, max_age_days=30):
+    """Deletes profiles nobody has used for `max_age_days` and that are not locked. Returns their names."""
+    import shutil
+    if not os.path.isdir(root):
+        return []
+    cutoff = time.time() - max_age_days * 86400
+    removed = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path) or os.path.exists(path + '.lock') or os.path.getmtime(path) >= cutoff:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+    return removed
+
+# Recorded network sessions for offline replay, see scrub_har
+HAR_DIR = os.path.join(APP_DIR, 'har')
+# Only CP Central traffic is recorded and replayed, never the SSO pages
+HAR_URL_FILTER = re.compile(r'^https://[^/]*cp-central\.catalog\.amazon\.dev/')
+SECRET_NAME = re.compile(r'cookie|authorization|token|csrf|session|credential|signature|x-amz-', re.IGNORECASE)
+SECRET_VALUE = re.compile(r'eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+')
+
+def scrub_har(har_file):
+    """
+    Removes secrets from a recorded HAR in place: cookies, headers and query
+    parameters whose name looks like a credential, and JWTs in text bodies.
+    Returns the number of values redacted.
+    """
+    from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+    with open(har_file, 'r', encoding='utf-8') as f:
+        har = json.load(f)
+    redacted = 0
+
+    def scrub_pairs(pairs):
+        nonlocal redacted
+        for pair in pairs:
+            if SECRET_NAME.search(pair.get('name', '')):
+                pair['value'] = 'REDACTED'
+                redacted += 1
+
+    for entry in har.get('log', {}).get('entries', []):
+        for message in (entry.get('request', {}), entry.get('response', {})):
+            redacted += len(message.get('cookies', []))
+            message['cookies'] = []
+            scrub_pairs(message.get('headers', []))
+        request = entry.get('request', {})
+        scrub_pairs(request.get('queryString', []))
+        parts = urlsplit(request.get('url', ''))
+        if parts.query:
+            query = [(name, 'REDACTED' if SECRET_NAME.search(name) else value) for name, value in parse_qsl(parts.query, keep_blank_values=True)]
+            request['url'] = urlunsplit(parts._replace(query=urlencode(query)))
+        for body in (request.get('postData', {}), entry.get('response', {}).get('content', {})):
+            if body.get('text') and body.get('encoding') != 'base64':
+                body['text'], count = SECRET_VALUE.subn('REDACTED', body['text'])
+                redacted += count
+    with open(har_file, 'w', encoding='utf-8') as f:
+        json.dump(har, f)
+    return redacted
+
+def compare_run_summaries(baseline, candidate):
+    """Lines comparing the step timings of two run_summary_*.json files, e.g. before and after a change."""
+    lines = [f"{'':<14}{'baseline':>12}{'candidate':>12}{'change':>9}"]
+
+    def row(label, old, new):
+        if old is None or new is None:
+            return
+        change = f"{(new - old) / old * 100:+.0f}%" if old else "-"
+        lines.append(f"{label:<14}{old:>12.2f}{new:>12.2f}{change:>9}")
+
+    row("duration s", baseline.get('duration_seconds'), candidate.get('duration_seconds'))
+    steps = list(dict.fromkeys(list(baseline.get('step_seconds', {})) + list(candidate.get('step_seconds', {}))))
+    for step in steps:
+        old = baseline.get('step_seconds', {}).get(step, {})
+        new = candidate.get('step_seconds', {}).get(step, {})
+        for stat in ('median', 'p95'):
+            row(f"{step} {stat}", old.get(stat), new.get(stat))
+    for key in ('asins', 'classes'):
+        old = baseline.get(key, {}).get('done')
+        new = candidate.get(key, {}).get('done')
+        if old != new:
+            lines.append(f"Warning: {key} done differ ({old} vs {new}), the runs did not do the same work.")
+    return lines
+
+# Rate and concurrency limits shared by every tool running on this machine
+GOVERNOR_DB_FILE = os.path.join(APP_DIR, 'xcp_governor.sqlite')
+
+class BackendGovernor:
+    """
+    Caps the backend-heavy calls (sample ASIN tests and export downloads) across
+    all pages and all running tools. Each kind of call has a token bucket
+    (`rate_per_min`, `burst`) and an in-flight limit, kept in SQLite so separate
+    processes share them. In-flight calls hold a lease that expires after
+    `lease_seconds`, so a crashed tool cannot keep its slots.
+
+    The in-flight limit adapts AIMD-style to the latencies reported through
+    `observe`: halved when a latency is above `target_latency` (at most once per
+    `target_latency` seconds), raised by 1/limit for every healthy one.
+    """
+
+    DEFAULT_LIMITS = {
+        'test': {'rate_per_min': 30, 'burst': 5, 'max_in_flight': 4, 'lease_seconds': 180},
+        'export': {'rate_per_min': 60, 'burst': 10, 'max_in_flight': 4, 'lease_seconds': 120},
+    }
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            kind TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            refilled_at REAL NOT NULL,
+            in_flight_limit REAL NOT NULL,
+            decreased_at REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            lease_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_leases_kind ON leases (kind, expires_at);
+    """
+
+    def __init__(self, path=GOVERNOR_DB_FILE, limits=None, target_latency=60.0):
+        self.limits = {kind: dict(values) for kind, values in self.DEFAULT_LIMITS.items()}
+        for kind, values in (limits or {}).items():
+            self.limits.setdefault(kind, {}).update(values)
+        self.target_latency = target_latency
+        # isolation_level=None: transactions are started explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.conn.executescript(self.SCHEMA)
+        self.waited = Counter()
+
+    def close(self):
+        self.conn.close()
+
+    def _try_acquire(self, kind):
+        """Takes a token and a lease if both are free. Returns (lease_id, None) or (None, seconds to wait)."""
+        limits = self.limits[kind]
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            row = self.conn.execute("SELECT tokens, refilled_at, in_flight_limit FROM buckets WHERE kind = ?", (kind,)).fetchone()
+            if row is None:
+                row = (limits['burst'], now, limits['max_in_flight'])
+                self.conn.execute("INSERT INTO buckets (kind, tokens, refilled_at, in_flight_limit) VALUES (?, ?, ?, ?)", (kind,) + row)
+            tokens, refilled_at, in_flight_limit = row
+            rate = limits['rate_per_min'] / 60
+            tokens = min(limits['burst'], tokens + (now - refilled_at) * rate)
+            in_flight = self.conn.execute("SELECT COUNT(*) FROM leases WHERE kind = ?", (kind,)).fetchone()[0]
+            if in_flight >= max(1, int(in_flight_limit)):
+                wait = 1.0
+            elif tokens < 1:
+                wait = (1 - tokens) / rate
+            else:
+                tokens -= 1
+                wait = None
+            self.conn.execute("UPDATE buckets SET tokens = ?, refilled_at = ? WHERE kind = ?", (tokens, now, kind))
+            lease_id = None
+            if wait is None:
+                lease_id = self.conn.execute(
+                    "INSERT INTO leases (kind, pid, expires_at) VALUES (?, ?, ?)",
+                    (kind, os.getpid(), now + limits['lease_seconds']),
+                ).lastrowid
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return lease_id, wait
+
+    async def acquire(self, kind):
+        """Waits for a free slot of `kind` and returns its lease id."""
+        started = time.monotonic()
+        while True:
+            lease_id, wait = self._try_acquire(kind)
+            if lease_id is not None:
+                self.waited[kind] += time.monotonic() - started
+                return lease_id
+            await asyncio.sleep(min(max(wait, 0.05), 5.0))
+
+    def release(self, lease_id):
+        if lease_id is None:
+            return
+        with self.conn:
+            self.conn.execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,))
+
+    def observe(self, kind, latency):
+        """Feeds one call latency into the AIMD in-flight limit of `kind`. Returns the new limit."""
+        maximum = self.limits[kind]['max_in_flight']
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT in_flight_limit, decreased_at FROM buckets WHERE kind = ?", (kind,)).fetchone()
+            limit, decreased_at = row if row else (maximum, 0)
+            if latency > self.target_latency:
+                # One spike shows up in every call in flight, only back off once per window
+                if now - decreased_at >= self.target_latency:
+                    limit, decreased_at = max(1.0, limit / 2), now
+            else:
+                limit = min(float(maximum), limit + 1 / max(limit, 1.0))
+            self.conn.execute("UPDATE buckets SET in_flight_limit = ?, decreased_at = ? WHERE kind = ?", (limit, decreased_at, kind))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        METRICS.set('xcp_governor_in_flight_limit', round(limit, 2), kind=kind)
+        return limit
+
+# Latency history the step timeouts are learned from
+LATENCY_HISTORY_FILE = os.path.join(APP_DIR, 'xcp_step_latency.json')
+
+class TimeoutTuner:
+    """
+    Per-step timeouts learned from how long the step took in earlier runs: the
+    p99 of a persisted latency histogram times `factor`, clamped to the step's
+    floor and ceiling. Steps with fewer than `min_samples` observations use their
+    default. Only completed steps go into the history; a timeout says nothing about
+    how long the step takes and would ratchet the timeout up. Instead it doubles
+    the step's timeout, at most MAX_BACKOFF times over, until the step completes
+    again; the back-off is not saved. Old observations are halved once a step has
+    `max_samples`, so the history follows changes.
+    """
+
+    # Log-spaced histogram bucket upper bounds in seconds, 50 ms to about 30 minutes
+    BOUNDS = tuple(round(0.05 * 1.25 ** i, 3) for i in range(48))
+    # step: (default, floor, ceiling) in ms
+    STEPS = {
+        'page_load': (10000, 3000, 60000),
+        'class_link': (5000, 2000, 30000),
+        'sample_test_button': (7000, 2000, 30000),
+        'asin_textarea': (10000, 3000, 60000),
+        'asin_fill': (20000, 5000, 120000),
+        'test_button': (5000, 2000, 30000),
+        'export_ready': (120000, 30000, 600000),
+        'export_button': (5000, 2000, 30000),
+        'marketplace_dropdown': (10000, 2000, 30000),
+        'marketplace_option': (3000, 1000, 15000),
+        'members_form': (15000, 3000, 60000),
+        'members_search': (10000, 2000, 60000),
+        'members_export': (60000, 10000, 300000),
+        'program_dropdown': (5000, 2000, 30000),
+        'program_option': (2000, 1000, 15000),
+    }
+
+    MAX_BACKOFF = 4
+
+    def __init__(self, path=LATENCY_HISTORY_FILE, factor=3.0, min_samples=20, max_samples=2000):
+        self.path = path
+        self.factor = factor
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.histograms = {}
+        self.backoff = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('bounds') == list(self.BOUNDS):
+                self.histograms = {step: counts for step, counts in saved.get('steps', {}).items() if len(counts) == len(self.BOUNDS) + 1}
+        except (OSError, ValueError):
+            pass
+
+    def observe(self, step, seconds):
+        counts = self.histograms.setdefault(step, [0.0] * (len(self.BOUNDS) + 1))
+        index = next((i for i, bound in enumerate(self.BOUNDS) if seconds <= bound), len(self.BOUNDS))
+        counts[index] += 1
+        if sum(counts) > self.max_samples:
+            self.histograms[step] = [count / 2 for count in counts]
+        self.backoff.pop(step, None)
+
+    def timed_out(self, step):
+        self.backoff[step] = min(self.backoff.get(step, 1) * 2, self.MAX_BACKOFF)
+
+    def quantile(self, step, q):
+        """Upper bound in seconds of the bucket holding quantile `q`, or None without enough data."""
+        counts = self.histograms.get(step)
+        if not counts or sum(counts) < self.min_samples:
+            return None
+        target = q * sum(counts)
+        seen = 0.0
+        for bound, count in zip(self.BOUNDS + (self.BOUNDS[-1] * 2,), counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.BOUNDS[-1] * 2
+
+    def timeout(self, step):
+        """Timeout for `step` in ms."""
+        default, floor, ceiling = self.STEPS[step]
+        p99 = self.quantile(step, 0.99)
+        base = default if p99 is None else max(p99 * 1000 * self.factor, floor)
+        return int(min(base * self.backoff.get(step, 1), ceiling))
+
+    def learned(self):
+        return {step: self.timeout(step) for step in self.STEPS if self.quantile(step, 0.99) is not None}
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'bounds': list(self.BOUNDS), 'steps': self.histograms}, f)
+
+# Daemon mode: workbooks dropped into the inbox are run as jobs, each into its own folder
+INBOX_DIR = os.path.join(APP_DIR, 'inbox')
+JOBS_DIR = os.path.join(APP_DIR, 'jobs')
+
+class InboxWatcher:
+    """
+    Finds the workbooks dropped into an inbox directory and hands them out as jobs,
+    most urgent first. Workbooks in the `high` and `low` subdirectories get that
+    priority, the rest are normal; within a priority the oldest goes first. A file
+    is only queued once its size has stayed the same between two scans, so a
+    workbook that is still being copied or saved is not picked up half written.
+    Finished workbooks are moved to `done` or `failed`.
+    """
+
+    PRIORITIES = {'high': 0, '': 1, 'low': 2}
+    PATTERNS = ('*.xlsx', '*.xls')
+
+    def __init__(self, inbox):
+        self.inbox = inbox
+        for subdir in ('high', 'low', 'done', 'failed'):
+            os.makedirs(os.path.join(inbox, subdir), exist_ok=True)
+        self.sizes = {}
+        # Files queued or being processed, so a scan does not queue them twice
+        self.queued = set()
+        self.jobs = []
+
+    def scan(self):
+        """Queues the workbooks that have finished arriving. Returns how many were added."""
+        added = 0
+        found = set()
+        for subdir, priority in self.PRIORITIES.items():
+            for pattern in self.PATTERNS:
+                for file in glob.glob(os.path.join(self.inbox, subdir, pattern)):
+                    # Skip the lock files Excel keeps next to open workbooks
+                    if os.path.basename(file).startswith('~$') or file in self.queued:
+                        continue
+                    found.add(file)
+                    try:
+                        stat = os.stat(file)
+                    except OSError:
+                        continue
+                    if self.sizes.get(file) != stat.st_size:
+                        self.sizes[file] = stat.st_size
+                        continue
+                    heapq.heappush(self.jobs, (priority, stat.st_mtime, file))
+                    self.queued.add(file)
+                    added += 1
+        self.sizes = {file: size for file, size in self.sizes.items() if file in found}
+        return added
+
+    def next_job(self):
+        """Returns (priority name, path) of the most urgent queued workbook, or None."""
+        while self.jobs:
+            priority, _, file = heapq.heappop(self.jobs)
+            if os.path.exists(file):
+                name = next(name for name, value in self.PRIORITIES.items() if value == priority)
+                return name or 'normal', file
+            self.queued.discard(file)
+        return None
+
+    def finish(self, file, ok):
+        """Moves a processed workbook out of the inbox and returns its new path."""
+        target_dir = os.path.join(self.inbox, 'done' if ok else 'failed')
+        stem, ext = os.path.splitext(os.path.basename(file))
+        target = os.path.join(target_dir, stem + ext)
+        if os.path.exists(target):
+            target = os.path.join(target_dir, f"{stem}_{datetime.datetime.now():%Y%m%d-%H%M%S}{ext}")
+        try:
+            os.replace(file, target)
+        finally:
+            self.queued.discard(file)
+        return target
+
+# Local store of exported result rows across runs
+RESULTS_DB_FILE = os.path.join(APP_DIR, 'xcp_results.sqlite')
+
+class ResultsStore:
+    """
+    Embedded SQLite store of every exported result row, keyed by run, class,
+    marketplace and ASIN and indexed for cross-run lookups.
+    Each export file is stored under its path, so storing it again replaces its rows.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            started_at TEXT NOT NULL,
+            input_file TEXT
+        );
+        CREATE TABLE IF NOT EXISTS results (
+            run_id TEXT NOT NULL,
+            class_name TEXT,
+            marketplace_id TEXT,
+            asin TEXT,
+            source_path TEXT NOT NULL,
+            row_json TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_results_asin ON results (asin, class_name, run_id);
+        CREATE INDEX IF NOT EXISTS idx_results_class ON results (class_name, marketplace_id, run_id);
+        CREATE INDEX IF NOT EXISTS idx_results_source ON results (source_path);
+    """
+    ASIN_COLUMNS = ('asin', 'asin_id')
+
+    def __init__(self, path=RESULTS_DB_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def start_run(self, run_id, input_file):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runs (run_id, started_at, input_file) VALUES (?, ?, ?)",
+                (run_id, datetime.datetime.now().isoformat(timespec='seconds'), input_file),
+            )
+
+    def has_source(self, file):
+        return self.conn.execute("SELECT 1 FROM results WHERE source_path = ? LIMIT 1", (os.path.abspath(file),)).fetchone() is not None
+
+    def add_export(self, run_id, file, class_name=None, marketplace_id=None, chunksize=50000):
+        """Stores every row of an export CSV. Returns the number of rows stored."""
+        import pandas as pd
+        source_path = os.path.abspath(file)
+        stored = 0
+        with self.conn:
+            self.conn.execute("DELETE FROM results WHERE source_path = ?", (source_path,))
+            for chunk in pd.read_csv(file, chunksize=chunksize, dtype=str, keep_default_na=False):
+                asin_col = next((col for col in chunk.columns if str(col).strip().lower() in self.ASIN_COLUMNS), None)
+                asins = chunk[asin_col].str.strip().str.upper() if asin_col else [None] * len(chunk)
+                rows = chunk.to_dict(orient='records')
+                self.conn.executemany(
+                    "INSERT INTO results (run_id, class_name, marketplace_id, asin, source_path, row_json) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((run_id, class_name, marketplace_id, asin, source_path, json.dumps(row)) for asin, row in zip(asins, rows)),
+                )
+                stored += len(rows)
+        return stored
+
+    def query(self, asin=None, class_name=None, marketplace_id=None, days=None, limit=200):
+        """Returns matching result rows, newest run first."""
+        where = []
+        params = []
+        if asin:
+            where.append("r.asin = ?")
+            params.append(asin.strip().upper())
+        if class_name:
+            where.append("r.class_name = ?")
+            params.append(class_name)
+        if marketplace_id:
+            where.append("r.marketplace_id = ?")
+            params.append(marketplace_id.strip().upper())
+        if days:
+            where.append("runs.started_at >= ?")
+            params.append((datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec='seconds'))
+        sql = (
+            "SELECT runs.started_at, r.run_id, r.class_name, r.marketplace_id, r.asin, r.row_json "
+            "FROM results r JOIN runs ON runs.run_id = r.run_id"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY runs.started_at DESC LIMIT ?"
+        )
+        params.append(limit)
+        return [
+            {'started_at': started_at, 'run_id': run_id, 'class_name': class_name, 'marketplace_id': marketplace_id,
+             'asin': asin, 'row': json.loads(row_json)}
+            for started_at, run_id, class_name, marketplace_id, asin, row_json in self.conn.execute(sql, params)
+        ]
+
+def format_result_rows(rows):
+    if not rows:
+        return "No stored results match."
+    lines = []
+    for row in rows:
+        details = ", ".join(f"{key}={value}" for key, value in row['row'].items() if value != '')
+        lines.append(f"{row['started_at']}  {row['class_name']}  {row['marketplace_id'] or '-'}  {row['asin'] or '-'}  {details}")
+    return "\n".join(lines)
+
 class XCPToolGUI(ctk.CTk):
+    DEFAULT_SUFFIXES = [
+        '_UIL', '_IN', '_US', '_CA', '_SG', '_AU', '_IE', '_UK', '_CS2',
+        '_Class_Consolidation', '_Paradigm', '_Mirage', '_100keyword', '_100_keyword'
+    ]
+    WORKER_NAME = "Worker 1"
+    CLASS_SEARCH_URL = 'https://www.cp-central.catalog.amazon.dev/#/class/search'
+    # Saved browser cookies, used to restore an expired SSO session without a new login
+    AUTH_STATE_FILE = os.path.join(APP_DIR, 'xcp_auth_state.json')
+
+    MEMBERS_URL = 'https://www.cp-central.catalog.amazon.dev/#/members'
+    # Programs the input can be pre-filtered against, and their label in the Programs dropdown
+    PROGRAMS = {'FS': 'Food Safety'}
+    MEMBERS_CHUNK_SIZE = 1000
+
+    # Ranked lookup strategies for page elements, see SelectorRegistry
+    SELECTORS = {
+        'sample_test_button': [
+            ('text', 'a:has-text("New sample ASINs test")'),
+            ('css', '#app-content > div > div > div:nth-child(1) > div > div.awsui-util-action-stripe-large > div.awsui-util-action-stripe-group.awsui-util-pv-n > awsui-button:nth-child(1) > a'),
+            ('xpath', 'xpath=//*[@id="app-content"]/div/div/div[1]/div/div[2]/div[2]/awsui-button[1]/a'),
+        ],
+        'test_button': [
+            ('text', 'button:has-text("Test sample ASINs")'),
+            ('css', 'button:has(span:text("Test sample ASINs"))'),
+        ],
+        'export_button': [
+            ('css', '#app-content > div > div:nth-child(3) > div.test-sample-asins-component > div:nth-child(4) > awsui-table > div > div.awsui-table-heading-container > div > div.awsui-table-header > span > div > div.awsui-util-action-stripe-group > awsui-button > button'),
+            ('text', '.test-sample-asins-component awsui-table button:has-text("Export")'),
+            ('css_short', '.test-sample-asins-component awsui-table .awsui-table-header .awsui-util-action-stripe-group awsui-button > button'),
+        ],
+    }
+
     # Mapping from marketplace_id to dropdown label
     MARKETPLACE_MAP = {
         'US': 'amazon.com',
@@ -113,6 +1543,40 @@ class XCPToolGUI(ctk.CTk):
         )
         self.browse_button.grid(row=0, column=2, padx=10, pady=10)
 
+        # Skip ASINs that are already members of the selected program
+        self.program_var = tk.StringVar(value="None")
+        self.program_label = ctk.CTkLabel(
+            self.file_frame,
+            text="Program pre-filter:",
+            font=ctk.CTkFont(size=14)
+        )
+        self.program_label.grid(row=1, column=0, padx=10, pady=10)
+        self.program_dropdown = ctk.CTkComboBox(
+            self.file_frame,
+            variable=self.program_var,
+            values=["None"] + list(self.PROGRAMS),
+            command=self.program_option_changed,
+            width=200
+        )
+        self.program_dropdown.grid(row=1, column=1, padx=10, pady=10, sticky="w")
+
+        # Record the CP Central traffic of a run, or replay a recording offline
+        self.network_var = tk.StringVar(value="Live")
+        self.network_label = ctk.CTkLabel(
+            self.file_frame,
+            text="Network:",
+            font=ctk.CTkFont(size=14)
+        )
+        self.network_label.grid(row=2, column=0, padx=10, pady=10)
+        self.network_dropdown = ctk.CTkComboBox(
+            self.file_frame,
+            variable=self.network_var,
+            values=["Live", "Record HAR", "Replay HAR"],
+            command=self.network_option_changed,
+            width=200
+        )
+        self.network_dropdown.grid(row=2, column=1, padx=10, pady=10, sticky="w")
+
         # Progress Frame
         self.progress_frame = ctk.CTkFrame(self.main_frame)
         self.progress_frame.grid(row=3, column=0, padx=20, pady=10, sticky="ew")
@@ -129,6 +1593,21 @@ class XCPToolGUI(ctk.CTk):
         )
         self.status_label.grid(row=1, column=0, pady=5)
 
+        self.metrics_label = ctk.CTkLabel(
+            self.progress_frame,
+            text="",
+            font=ctk.CTkFont(size=12)
+        )
+        self.metrics_label.grid(row=2, column=0, pady=2)
+
+        self.workers_label = ctk.CTkLabel(
+            self.progress_frame,
+            text="",
+            font=ctk.CTkFont(size=11),
+            justify="left"
+        )
+        self.workers_label.grid(row=3, column=0, pady=2)
+
         # Log Frame
         self.log_frame = ctk.CTkFrame(self.main_frame)
         self.log_frame.grid(row=4, column=0, padx=20, pady=10, sticky="ew")
@@ -162,6 +1641,58 @@ class XCPToolGUI(ctk.CTk):
         )
         self.stop_button.grid(row=0, column=1, padx=10)
 
+        self.drain_button = ctk.CTkButton(
+            self.button_frame,
+            text="Finish Current Batch",
+            command=self.drain_processing,
+            width=150,
+            state="disabled"
+        )
+        self.drain_button.grid(row=0, column=4, padx=10)
+
+        self.watch_button = ctk.CTkButton(
+            self.button_frame,
+            text="Watch Inbox",
+            command=self.toggle_watch,
+            width=150
+        )
+        self.watch_button.grid(row=1, column=4, padx=10, pady=(10, 0))
+
+        self.parquet_var = tk.BooleanVar(value=False)
+        self.parquet_checkbox = ctk.CTkCheckBox(
+            self.button_frame,
+            text="Also save Parquet dataset",
+            variable=self.parquet_var,
+            command=self.parquet_option_changed
+        )
+        self.parquet_checkbox.grid(row=0, column=2, padx=10)
+
+        self.query_button = ctk.CTkButton(
+            self.button_frame,
+            text="Query Results",
+            command=self.open_results_query,
+            width=150
+        )
+        self.query_button.grid(row=0, column=3, padx=10)
+
+        self.profile_var = tk.BooleanVar(value=False)
+        self.profile_checkbox = ctk.CTkCheckBox(
+            self.button_frame,
+            text="Keep browser cache between runs",
+            variable=self.profile_var,
+            command=self.profile_option_changed
+        )
+        self.profile_checkbox.grid(row=1, column=2, columnspan=2, padx=10, pady=(10, 0), sticky="w")
+
+        self.trace_var = tk.BooleanVar(value=True)
+        self.trace_checkbox = ctk.CTkCheckBox(
+            self.button_frame,
+            text="Save traces of failed batches",
+            variable=self.trace_var,
+            command=self.trace_option_changed
+        )
+        self.trace_checkbox.grid(row=1, column=0, columnspan=2, padx=10, pady=(10, 0), sticky="w")
+
         # Suffix Management Frame
         self.suffix_frame = ctk.CTkFrame(self.main_frame)
         self.suffix_frame.grid(row=2, column=0, padx=20, pady=10, sticky="ew")
@@ -217,15 +1748,59 @@ class XCPToolGUI(ctk.CTk):
         self.remove_suffix_button.grid(row=2, column=1, padx=10, pady=5)
         self.remove_suffix_button.grid_remove()  # Hide initially
 
-        # Initialize suffixes
-        self.suffixes = [
-            '_UIL', '_IN', '_US', '_CA', '_SG', '_AU', '_IE', '_UK', '_CS2',
-            '_Class_Consolidation', '_Paradigm', '_Mirage', '_100keyword', '_100_keyword'
-        ]
+        # Initialize suffixes, restoring the list saved in the last session
+        self.settings = load_settings()
+        self.suffixes = list(self.settings.get('suffixes', self.DEFAULT_SUFFIXES))
+        self.rebuild_suffix_matcher()
+        self.parquet_var.set(bool(self.settings.get('parquet_output', False)))
+        self.program_var.set(self.settings.get('program_filter', "None"))
+        self.profile_var.set(bool(self.settings.get('persistent_profile', False)))
+        self.trace_var.set(bool(self.settings.get('trace_failures', True)))
+        self.selectors = SelectorRegistry(self.SELECTORS, self.settings.get('selector_cache'))
+        self.timeouts = TimeoutTuner(factor=float(self.settings.get('timeout_factor', 3.0)))
         # Do not show suffixes at startup
 
         # Initialize processing flag
         self.is_processing = False
+        self.draining = False
+        self.run_task = None
+        # Daemon mode: the inbox watch task and the browser kept open between its jobs
+        self.watching = False
+        self.watch_task = None
+        self.warm_session = None
+        self.test_latencies = []
+        self.marketplace_cache = {'options': None, 'resolved': {}, 'selectors': {}}
+        self.retry_policy = RetryPolicy()
+        self.max_requeues = 1
+        self.circuit_breaker = CircuitBreaker()
+        self.retry_counts = Counter()
+        self.collator = None
+        self.results_store = None
+        self.run_id = None
+        # Set for the length of a run that replays a HAR recording
+        self.replaying = False
+        self.metrics = RunMetrics()
+        self.dashboard_job = None
+        self.auth_ok = asyncio.Event()
+        self.auth_generation = 0
+        self.reauth_lock = asyncio.Lock()
+        self.run_info = {}
+        self.run_started = time.monotonic()
+        self.step_durations = {}
+        self.download_bytes = 0
+        self.run_outputs = []
+        self.metrics_server = None
+        self.page_pool = None
+        self.tracer = None
+        self.governor = None
+        self.test_lease = None
+        self.profile = None
+        self.har_file = None
+        self.replay_har = None
+        self.work_ready = asyncio.Event()
+        self.membership_counts = Counter()
+        if self.settings.get('metrics_port'):
+            self.start_metrics_server(int(self.settings['metrics_port']))
 
         # Keep the event loop running with Tkinter
         self.after(100, self._run_asyncio_loop)
@@ -251,28 +1826,86 @@ class XCPToolGUI(ctk.CTk):
     def update_progress(self, value):
         self.progress_bar.set(value)
 
-    async def process_asins(self):
+    def set_worker_step(self, step, worker=None):
+        self.metrics.set_worker_step(worker or self.WORKER_NAME, step)
+
+    def refresh_dashboard(self):
+        """Updates the live metrics panel once a second while a run is going."""
+        metrics = self.metrics
+        classes_per_min, asins_per_min = metrics.rates()
+        eta = metrics.eta_seconds()
+        eta_text = f"{eta / 60:.0f} min" if eta is not None else "-"
+        self.metrics_label.configure(
+            text=f"{classes_per_min:.1f} classes/min | {asins_per_min:.0f} ASINs/min | "
+                 f"Done: {metrics.done_classes}/{metrics.total_classes} classes, "
+                 f"{metrics.done_asins}/{metrics.total_asins} ASINs | ETA: {eta_text}"
+        )
+        self.workers_label.configure(text="\n".join(f"{worker}: {step}" for worker, step in metrics.worker_steps.items()))
+        # Setup takes the first 40% of the bar, the batches the rest
+        self.update_progress(0.4 + 0.6 * metrics.progress())
+        METRICS.set('xcp_run_progress_ratio', round(metrics.progress(), 4))
+        METRICS.set('xcp_asins_remaining', metrics.remaining_asins)
+        if self.dashboard_job is not None:
+            self.after_cancel(self.dashboard_job)
+            self.dashboard_job = None
+        if self.is_processing:
+            self.dashboard_job = self.after(1000, self.refresh_dashboard)
+
+    async def process_asins(self, input_file=None, export_dir=None):
+        """
+        Runs one workbook (the selected file unless `input_file` is given) and writes
+        its exports to `export_dir`, by default today's exports folder. While the
+        inbox is watched the browser is taken from and left in self.warm_session.
+        """
         import datetime
         import time as pytime
+        import pandas as pd
+        import pyautogui
+        from playwright.async_api import async_playwright
         playwright = None
         browser = None
         context = None
         page = None
+        prefilter_task = None
         script_dir = os.path.dirname(os.path.abspath(__file__))
-        export_dir = os.path.join(script_dir, f"exports_{datetime.date.today()}")
+        input_file = input_file or self.file_path.get()
+        export_dir = export_dir or os.path.join(script_dir, f"exports_{datetime.date.today()}")
         os.makedirs(export_dir, exist_ok=True)
+        # A replay must not teach live runs anything: its latencies are near zero and its
+        # results are recorded ones. It works on copies of the learned state, which are
+        # dropped afterwards, and leaves the results store, membership cache and governor alone.
+        self.replaying = self.network_var.get() == "Replay HAR"
+        live_timeouts = live_selectors = None
+        if self.replaying:
+            import copy
+            live_timeouts, self.timeouts = self.timeouts, copy.deepcopy(self.timeouts)
+            live_selectors = dict(self.selectors.preferred)
+        stale = remove_partial_files(export_dir)
+        if stale:
+            self.update_log(f"Removed {stale} partial file(s) left by an earlier run.")
+        self.collator = self.create_collator(export_dir)
+        self.run_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.page_pool = None
+        self.tracer = None
+        self.start_run_summary(input_file)
         try:
-            self.update_log("Maximizing window using PyAutoGUI...")
-            pyautogui.hotkey('win', 'up')
-            time.sleep(1)
+            if not self.watching:
+                self.update_log("Maximizing window using PyAutoGUI...")
+                pyautogui.hotkey('win', 'up')
+                time.sleep(1)
 
-            input_file = self.file_path.get()
             if not input_file:
-                messagebox.showerror("Error", "Please select an input file")
+                self.update_log("Error: No input file selected.")
+                self.show_run_error("Please select an input file")
                 return
 
             self.update_status("Initializing...")
             self.update_progress(0.1)
+            if self.replaying:
+                self.update_log("Replay run: results store, membership cache, backend governor and learned timeouts are not updated.")
+            else:
+                self.open_results_store(input_file)
+                self.open_governor()
 
             df = pd.read_excel(input_file)
             if 'Class' in df.columns:
@@ -280,23 +1913,40 @@ class XCPToolGUI(ctk.CTk):
             elif 'rule_name' in df.columns:
                 group_col = 'rule_name'
             else:
-                messagebox.showerror("Error", "Input file must contain a 'Class' or 'rule_name' column.")
+                self.show_run_error("Input file must contain a 'Class' or 'rule_name' column.")
                 self.update_log("Error: No 'Class' or 'rule_name' column found in input file.")
                 return
             self.update_log(f"Successfully loaded {len(df)} rows from Excel. Grouping by '{group_col}' column.")
+            df = self.preflight_check(df, group_col)
+            if df is None or df.empty:
+                self.update_log("Error: No valid ASINs left to process after input validation.")
+                self.show_run_error("No valid ASINs left to process after input validation.")
+                return
             self.update_progress(0.2)
 
-            playwright = await async_playwright().start()
-            browser = await playwright.chromium.launch(headless=False, args=['--start-maximized'])
-            context = await browser.new_context(viewport=None)
-            page = await context.new_page()
-            self.update_log("Browser initialized successfully")
+            if self.warm_session is not None and not await self.warm_session_usable():
+                self.update_log("The browser kept open is no longer usable, starting a new one.")
+                await self.close_warm_session()
+            if self.warm_session is not None:
+                playwright, context, browser, page = self.warm_session
+                self.update_log("Reusing the browser kept open from the last job")
+            else:
+                playwright = await async_playwright().start()
+                context, browser = await self.launch_browser(playwright)
+                # Watch every page of the context for SSO redirects
+                context.on("page", self.watch_session)
+                for open_page in context.pages:
+                    self.watch_session(open_page)
+                page = context.pages[0] if context.pages else await context.new_page()
+                self.update_log("Browser initialized successfully")
+                if self.watching:
+                    self.warm_session = (playwright, context, browser, page)
             self.update_progress(0.3)
-            await page.goto('https://www.cp-central.catalog.amazon.dev/#/class/search')
+            await page.goto(self.CLASS_SEARCH_URL)
             self.update_log("Navigated to CP Central")
             self.update_progress(0.4)
             # SSO Login Handling
-            if "SSO/redirect" in page.url or "midway-auth.amazon.com" in page.url:
+            if is_auth_url(page.url):
                 self.update_log("SSO login required. Please complete the login in the opened browser window.")
                 try:
                     await page.wait_for_selector('#awsui-input-0', timeout=0)
@@ -304,87 +1954,945 @@ class XCPToolGUI(ctk.CTk):
                 except Exception as e:
                     self.update_log(f"Error waiting for login: {str(e)}")
                     return
-            await page.wait_for_selector('#awsui-input-0', timeout=10000)
+            await self.timed('page_load', lambda timeout: page.wait_for_selector('#awsui-input-0', timeout=timeout))
+            await self.save_auth_state(context)
+            self.auth_ok.set()
             await page.wait_for_timeout(500)
+            self.page_pool = PagePool(context, page)
+            if self.trace_var.get():
+                self.tracer = FailureTracer(context)
+                await self.tracer.start()
 
-            class_search_url = 'https://www.cp-central.catalog.amazon.dev/#/class/search'
+            class_search_url = self.CLASS_SEARCH_URL
             class_counter = 0
-            total_classes = len(df[group_col].unique())
+            work_plan = self.plan_work(df, group_col)
+            total_classes = len(work_plan)
             start_time = pytime.time()
-            for class_name, group in df.groupby(group_col):
+            self.metrics = RunMetrics(total_classes, sum(len(batch[3]) for _, batches in work_plan for batch in batches))
+            self.refresh_dashboard()
+            self.test_latencies = []
+            self.marketplace_cache = {'options': None, 'resolved': {}, 'selectors': {}}
+            self.circuit_breaker = CircuitBreaker()
+            learned = self.timeouts.learned()
+            if learned:
+                self.update_log("Step timeouts learned from earlier runs: " + ", ".join(f"{step} {ms / 1000:.1f}s" for step, ms in learned.items()))
+            program = self.program_var.get()
+            if program in self.PROGRAMS:
+                # Classes are queued as their membership results come in
+                work_queue = deque()
+                prefilter_task = asyncio.ensure_future(self.prefilter_memberships(context, program, work_plan, work_queue, export_dir))
+            else:
+                work_queue = deque({'class_name': class_name, 'batches': batches, 'requeues': 0} for class_name, batches in work_plan)
+                prefilter_task = None
+            while True:
                 if not self.is_processing:
                     self.update_log("Processing stopped by user")
+                    self.set_worker_step("Stopped")
                     break
-                # Periodically close and reopen the page every 15 classes
+                if self.draining:
+                    self.update_log(f"Current batches finished, {len(work_queue)} class(es) left for a later run.")
+                    self.set_worker_step("Drained")
+                    self.run_info['status'] = 'drained'
+                    break
+                if not work_queue:
+                    if prefilter_task is None or prefilter_task.done():
+                        break
+                    self.set_worker_step("Waiting for membership results")
+                    self.work_ready.clear()
+                    try:
+                        await asyncio.wait_for(self.work_ready.wait(), timeout=1)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if not self.auth_ok.is_set():
+                    # The watchdog saw an SSO redirect on one of the pages, log in again before the next class
+                    if not await self.reauthenticate(self.page_pool.active, self.auth_generation):
+                        self.update_log(f"SSO session could not be restored. Stopping with {len(work_queue)} class(es) still queued.")
+                        break
+                item = work_queue.popleft()
+                class_name = item['class_name']
+                # Periodically close and reopen the pages every 15 classes
                 if class_counter > 0 and class_counter % 15 == 0:
                     try:
-                        await page.close()
-                        self.update_log(f"Page closed to free resources after {class_counter} classes.")
+                        await self.page_pool.recycle(class_search_url)
+                        self.update_log(f"Pages closed to free resources after {class_counter} classes.")
                     except Exception as e:
-                        self.update_log(f"Error closing page: {str(e)}")
-                    page = await context.new_page()
-                    await page.goto(class_search_url)
-                    await page.wait_for_timeout(1000)
+                        self.update_log(f"Error recycling pages: {str(e)}")
+                        if self.page_pool.active.is_closed():
+                            self.page_pool.active = await context.new_page()
+                            await self.page_pool.active.goto(class_search_url)
+                    await self.page_pool.active.wait_for_timeout(1000)
                     self.update_log("New page opened in same context (SSO session preserved).")
                 class_counter += 1
                 class_start = pytime.time()
-                clean_name = self.clean_class_name(class_name)
-                self.update_log(f"Processing class {class_counter}/{total_classes}: {clean_name}")
+                # Class names were already cleaned by preflight_check
+                clean_name = class_name
+                if item['requeues']:
+                    self.update_log(f"Retrying {len(item['batches'])} failed batch(es) of class: {clean_name}")
+                else:
+                    self.update_log(f"Processing class {class_counter}/{self.metrics.total_classes}: {clean_name}")
                 try:
-                    await self.process_class(page, class_search_url, clean_name, group, export_dir)
+                    next_class = work_queue[0]['class_name'] if work_queue else None
+                    failed_batches = await self.process_class(class_search_url, clean_name, item['batches'], export_dir, next_class)
                     elapsed = pytime.time() - class_start
                     self.update_log(f"Class '{clean_name}' processed in {elapsed:.2f} seconds.")
                 except Exception as e:
                     self.update_log(f"Error processing class {clean_name}: {str(e)}")
+                    failed_batches = item['batches']
+                if self.draining and failed_batches:
+                    # Batches not started are left for a later run, the class is not done
+                    work_queue.appendleft({'class_name': class_name, 'batches': failed_batches, 'requeues': item['requeues']})
                     continue
+                if failed_batches:
+                    if item['requeues'] < self.max_requeues:
+                        work_queue.append({'class_name': class_name, 'batches': failed_batches, 'requeues': item['requeues'] + 1})
+                        self.update_log(f"Re-queued {len(failed_batches)} failed batch(es) of class '{clean_name}' to the end of the run.")
+                        continue
+                    self.update_log(f"Giving up on {len(failed_batches)} batch(es) of class '{clean_name}'.")
+                    self.metrics.skip_asins(sum(len(batch[3]) for batch in failed_batches), len(failed_batches))
+                self.metrics.record_class()
+                METRICS.inc('xcp_classes_done_total')
             total_elapsed = pytime.time() - start_time
+            self.metrics.set_worker_step(self.WORKER_NAME, "Finished")
             self.update_status("Processing complete")
             self.update_progress(1.0)
             self.update_log(f"All classes processed in {total_elapsed/60:.2f} minutes.")
+            if not work_queue and self.is_processing:
+                self.run_info['status'] = 'completed'
+            if self.membership_counts:
+                self.update_log(
+                    f"Program pre-filter: {self.membership_counts['cached']} ASINs from cache, "
+                    f"{self.membership_counts['checked']} checked on the members page, {self.membership_counts['members']} members skipped."
+                )
+            self.log_test_latency_summary()
+            if self.retry_counts:
+                self.update_log(f"Retries by fault: {dict(self.retry_counts)}")
+            if self.tracer is not None:
+                self.log_tracing_report()
+            if self.page_pool.hits or self.page_pool.misses:
+                self.update_log(f"Preloaded class forms used for {self.page_pool.hits} batch(es), {self.page_pool.misses} preload(s) wasted.")
+            self.log_selector_summary()
+        except asyncio.CancelledError:
+            # Stop pressed: in-flight steps were cancelled, clean up and collate what finished
+            self.run_info['status'] = 'cancelled'
+            self.update_log("Processing cancelled by user, in-flight batches abandoned.")
+            self.set_worker_step("Stopped")
         except Exception as e:
             self.update_log(f"Error: {str(e)}")
             logging.error(f"Error in process_asins: {str(e)}", exc_info=True)
-            messagebox.showerror("Error", str(e))
+            self.show_run_error(str(e))
         finally:
-            if browser:
-                try:
-                    await browser.close()
-                    self.update_log("Browser closed")
-                except Exception as e:
-                    logging.error(f"Error closing browser: {str(e)}")
-            if playwright:
-                await playwright.stop()
+            if prefilter_task is not None and not prefilter_task.done():
+                prefilter_task.cancel()
+                await asyncio.wait({prefilter_task})
+            if self.page_pool is not None:
+                await self.page_pool.cancel()
+            if self.tracer is not None:
+                await self.tracer.stop()
+            if self.warm_session is not None and self.warm_session[1] is context:
+                # Daemon mode: the browser stays open and signed in for the next job
+                if self.page_pool is not None:
+                    standby = self.page_pool.standby
+                    if standby is not None and not standby.is_closed():
+                        await standby.close()
+                    self.warm_session = (playwright, context, browser, self.page_pool.active)
+                if not self.watching:
+                    await self.close_warm_session()
+            elif playwright is not None:
+                await self.close_browser(playwright, context, browser)
             self.is_processing = False
-            self.start_button.configure(state="normal")
-            self.stop_button.configure(state="disabled")
+            self.draining = False
+            self.auth_ok.clear()
+            if self.replaying:
+                self.timeouts = live_timeouts
+                self.selectors.preferred = live_selectors
+                self.replaying = False
+            else:
+                self.save_selector_cache()
+                self.save_latency_history()
+            if self.governor is not None:
+                self.governor.close()
+                self.governor = None
+            self.reset_buttons()
             await self.collate_exports(export_dir)
+            self.write_run_summary(export_dir)
 
-    async def process_class(self, page, class_search_url, class_name, group, export_dir):
-        # Retry logic: try up to 3 times if class input is not found
-        max_retries = 3
-        for attempt in range(1, max_retries + 1):
-            input_box = page.locator('input[placeholder*="class name"]')
-            found = await self.wait_for_visible_enabled(input_box, page)
-            if found:
+    def show_run_error(self, message, title="Error"):
+        """
+        Marks the run as failed and shows `message` in a dialog. While the inbox is
+        watched nobody is there to close a dialog, so the job just fails (the caller
+        has logged the error) and its workbook goes to inbox/failed.
+        """
+        self.run_info['status'] = 'failed'
+        self.run_info['error'] = message
+        if not self.watching:
+            messagebox.showerror(title, message)
+
+    def preflight_check(self, df, group_col, batch_size=900):
+        """
+        Validates and normalizes the input before the browser is started, using
+        column-wide operations only:
+        - ASINs are stripped and upper-cased, Excel float artefacts ('.0') removed and
+          numeric ASINs zero-padded back to 10 characters; anything that is still not
+          a 10 character alphanumeric ASIN is dropped.
+        - Class names are cleaned with clean_class_names, empty classes dropped.
+        - marketplace_id values not in MARKETPLACE_MAP are dropped; blank ones are kept
+          as missing and tested with "All marketplaces".
+        - Duplicate ASINs per class/marketplace are removed.
+        Logs a summary of the work the run will do. Returns None if a required column is missing.
+        """
+        import pandas as pd
+        if 'asin_id' not in df.columns:
+            self.show_run_error("Input file must contain an 'asin_id' column.")
+            self.update_log("Error: No 'asin_id' column found in input file.")
+            return None
+        total_rows = len(df)
+        df = df.copy()
+
+        # Excel hands numeric ASINs over as floats, e.g. 123456789.0 for 0123456789
+        asins = df['asin_id'].astype('string').fillna('').str.strip().str.upper().str.replace(r'\.0+$', '', regex=True)
+        asins = asins.mask(asins.str.fullmatch(r'\d{1,9}'), asins.str.zfill(10))
+        df['asin_id'] = asins
+        missing_asin = asins == ''
+        invalid_asin = ~missing_asin & ~asins.str.fullmatch(r'[A-Z0-9]{10}')
+
+        df[group_col] = self.clean_class_names(df[group_col].astype('string').fillna('').str.strip())
+        missing_class = df[group_col] == ''
+
+        key_cols = [group_col, 'asin_id']
+        unknown_marketplace = pd.Series(False, index=df.index)
+        if 'marketplace_id' in df.columns:
+            marketplace_ids = df['marketplace_id'].astype('string').str.strip().str.upper()
+            df['marketplace_id'] = marketplace_ids.mask(marketplace_ids == '')
+            unknown_marketplace = df['marketplace_id'].notna() & ~df['marketplace_id'].isin(list(self.MARKETPLACE_MAP.keys()))
+            key_cols.insert(1, 'marketplace_id')
+
+        if invalid_asin.any():
+            examples = df.loc[invalid_asin, 'asin_id'].head(5).tolist()
+            self.update_log(f"Dropping {int(invalid_asin.sum())} rows with invalid ASINs, e.g. {examples}")
+        if unknown_marketplace.any():
+            unknown = df.loc[unknown_marketplace, 'marketplace_id'].unique()[:10].tolist()
+            self.update_log(f"Dropping {int(unknown_marketplace.sum())} rows with unknown marketplace_id: {unknown}")
+        valid = df[~(missing_asin | invalid_asin | missing_class | unknown_marketplace)]
+        deduped = valid.drop_duplicates(subset=key_cols)
+
+        group_sizes = deduped.groupby(key_cols[:-1], dropna=False).size()
+        total_batches = int(((group_sizes + batch_size - 1) // batch_size).sum())
+        marketplace_text = f", {deduped['marketplace_id'].nunique()} marketplaces" if 'marketplace_id' in deduped.columns else ""
+        self.update_log(
+            f"Pre-flight: {total_rows} rows read, {int(missing_asin.sum())} without ASIN, "
+            f"{int(invalid_asin.sum())} invalid ASINs, {int(missing_class.sum())} without class, "
+            f"{int(unknown_marketplace.sum())} unknown marketplaces, {len(valid) - len(deduped)} duplicates removed."
+        )
+        self.update_log(
+            f"Workload: {len(deduped)} ASINs in {deduped[group_col].nunique()} classes{marketplace_text}, "
+            f"{total_batches} batches of up to {batch_size}."
+        )
+        return deduped
+
+    def plan_work(self, df, group_col, batch_size=900):
+        """
+        Groups the input by (class, marketplace_id) and orders it so consecutive batches
+        share a marketplace: classes are sorted by the marketplaces they need, and each
+        class starts with the marketplace the previous class finished on.
+        Returns a list of (class_name, batches) where each batch is
+        (marketplace_id, batch_num, total_batches, asins).
+        """
+        import pandas as pd
+        if 'marketplace_id' in df.columns:
+            marketplace_ids = df['marketplace_id'].astype('string').str.strip().str.upper()
+            df = df.assign(marketplace_id=marketplace_ids.mask(marketplace_ids == ''))
+            # Blank marketplaces stay a group of their own, tested with "All marketplaces"
+            grouped = (
+                ((class_name, None if pd.isna(marketplace_id) else marketplace_id), group)
+                for (class_name, marketplace_id), group in df.groupby([group_col, 'marketplace_id'], dropna=False)
+            )
+        else:
+            grouped = (((class_name, None), group) for class_name, group in df.groupby(group_col))
+        classes = {}
+        for (class_name, marketplace_id), group in grouped:
+            classes.setdefault(class_name, []).append((marketplace_id, group))
+        ordered = sorted(classes.items(), key=lambda item: [marketplace_id or '' for marketplace_id, _ in item[1]])
+        work_plan = []
+        last_marketplace = None
+        for class_name, marketplace_groups in ordered:
+            marketplace_groups.sort(key=lambda item: item[0] != last_marketplace)
+            last_marketplace = marketplace_groups[-1][0]
+            # Input ASINs in batches of 900, per marketplace
+            batches = []
+            for marketplace_id, group in marketplace_groups:
+                asins = group['asin_id'].astype(str).tolist()
+                total = (len(asins) + batch_size - 1) // batch_size
+                for batch_num, i in enumerate(range(0, len(asins), batch_size), 1):
+                    batches.append((marketplace_id, batch_num, total, asins[i:i+batch_size]))
+            work_plan.append((class_name, batches))
+        return work_plan
+
+    async def prefilter_memberships(self, context, program, work_plan, work_queue, export_dir):
+        """
+        Program pre-filter stage, run next to class testing on its own page of the
+        authenticated context. The ASINs of the planned classes are checked on the
+        members page in chunks of MEMBERS_CHUNK_SIZE, in the order the classes will
+        be tested. As soon as all ASINs of a class are checked, its batches minus the
+        program members are put on `work_queue`, so testing starts after the first
+        chunk instead of after the whole input. ASINs with a fresh entry in the
+        membership cache are not sent to the members page at all.
+        """
+        import pandas as pd
+        worker = "Pre-filter"
+        members = set()
+        checked = set()
+        chunk = []
+        queued = set()
+        waiting = deque()
+        # Number of work_plan classes added to `waiting` so far
+        planned_classes = 0
+        page = None
+        cache = None
+
+        def release(ready_only=True):
+            released = 0
+            while waiting and (not ready_only or waiting[0][2] <= checked):
+                class_name, batches, class_asins = waiting.popleft()
+                kept = filter_batches(batches, members)
+                removed = sum(len(batch[3]) for batch in batches) - sum(len(batch[3]) for batch in kept)
+                if kept:
+                    work_queue.append({'class_name': class_name, 'batches': kept, 'requeues': 0})
+                    released += 1
+                else:
+                    self.update_log(f"All ASINs of class {class_name} are already {program} members, skipping it.")
+                self.metrics.exclude(0 if kept else 1, removed)
+            if released or not ready_only:
+                self.work_ready.set()
+
+        async def check_chunk():
+            nonlocal page
+            if page is None or page.is_closed():
+                page = await context.new_page()
+            chunk_num = self.membership_counts['chunks'] + 1
+            self.set_worker_step(f"Checking {program} membership of {len(chunk)} ASINs (chunk {chunk_num})", worker)
+            try:
+                found = await self.run_step(
+                    f"{program} membership chunk {chunk_num}",
+                    lambda: self.check_membership(page, program, chunk, export_dir, chunk_num),
+                    page,
+                )
+                if cache is not None:
+                    try:
+                        cache.store(program, chunk, found)
+                    except sqlite3.Error as e:
+                        self.update_log(f"Could not update the membership cache: {str(e)}")
+            except StepError as e:
+                # Testing a member again is only wasted time, dropping a non-member would lose results
+                self.update_log(f"{str(e)} Testing these {len(chunk)} ASINs without the pre-filter.")
+                found = set()
+            members.update(found)
+            checked.update(chunk)
+            queued.difference_update(chunk)
+            self.membership_counts['chunks'] += 1
+            self.membership_counts['checked'] += len(chunk)
+            self.membership_counts['members'] += len(found)
+            chunk.clear()
+            release()
+
+        try:
+            cache = self.open_membership_cache()
+            if cache is not None:
+                planned = pd.Series([asin for _, batches in work_plan for batch in batches for asin in batch[3]]).drop_duplicates()
+                cached = cache.lookup(program, planned)
+                checked.update(cached['asin'])
+                members.update(cached.loc[cached['is_member'] == 1, 'asin'])
+                self.membership_counts['cached'] += len(cached)
+                self.membership_counts['members'] += int((cached['is_member'] == 1).sum())
+                self.update_log(f"{len(cached)} of {len(planned)} ASINs found in the {program} membership cache, {len(planned) - len(cached)} left to check.")
+            for class_name, batches in work_plan:
+                class_asins = set(asin for batch in batches for asin in batch[3])
+                waiting.append((class_name, batches, class_asins))
+                planned_classes += 1
+                for asin in dict.fromkeys(asin for batch in batches for asin in batch[3]):
+                    if asin in checked or asin in queued:
+                        continue
+                    queued.add(asin)
+                    chunk.append(asin)
+                    if len(chunk) >= self.MEMBERS_CHUNK_SIZE:
+                        await check_chunk()
+                        if not self.is_processing or self.draining:
+                            return
+                # Classes whose ASINs were all seen in earlier chunks can go straight away
+                release()
+            if chunk:
+                await check_chunk()
+            self.set_worker_step("Done", worker)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.update_log(f"Program pre-filter failed, testing the remaining classes unfiltered: {str(e)}")
+            logging.error(f"Error in prefilter_memberships: {str(e)}", exc_info=True)
+            self.set_worker_step("Failed", worker)
+            # Classes the pre-filter never got to are released below with the rest
+            waiting.extend((class_name, batches, set()) for class_name, batches in work_plan[planned_classes:])
+        finally:
+            release(ready_only=False)
+            if cache is not None:
+                cache.close()
+            if page is not None and not page.is_closed():
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+
+    def open_membership_cache(self):
+        if self.replaying:
+            return None
+        try:
+            return MembershipCache(ttl_days=float(self.settings.get('membership_ttl_days', 7)))
+        except Exception as e:
+            self.update_log(f"Membership cache not available, checking every ASIN: {str(e)}")
+            return None
+
+    async def check_membership(self, page, program, asins, export_dir, chunk_num):
+        """
+        Runs one members page search for `asins` in `program` and returns the set of
+        ASINs the export marks as members.
+        """
+        import pandas as pd
+        if page.url == self.MEMBERS_URL:
+            # Going to the same #/members URL would not reset the form, and clicking the
+            # program still selected from the last chunk would deselect it
+            await page.reload(wait_until="domcontentloaded")
+        else:
+            await page.goto(self.MEMBERS_URL, wait_until="domcontentloaded")
+        asin_box = page.locator('textarea[placeholder*="Enter ASIN"]')
+        await self.timed('members_form', lambda timeout: asin_box.wait_for(state="visible", timeout=timeout))
+        await asin_box.fill('\n'.join(asins))
+        await self.select_program(page, self.PROGRAMS[program])
+        search_btn = page.locator('.awsui-button-variant-primary')
+        # click() waits for the button to become enabled once the program is selected
+        await self.timed('members_search', lambda timeout: search_btn.click(timeout=timeout))
+        export_btn = page.locator('span[awsui-button-region="text"]:text-is("Export")')
+        await self.timed('members_export', lambda timeout: export_btn.wait_for(state="visible", timeout=timeout))
+        member_file = os.path.join(export_dir, f"{program.lower()}_membership_{self.run_id}_chunk{chunk_num}.xlsx")
+        lease = await self.acquire_slot('export')
+        try:
+            async with page.expect_download() as download_info:
+                await export_btn.click(force=True)
+            download = await download_info.value
+            await download.save_as(member_file + '.part')
+            os.replace(member_file + '.part', member_file)
+        except Exception as e:
+            raise StepError(f"Membership export download failed: {str(e)}", FAULT_DOWNLOAD) from e
+        finally:
+            self.release_slot(lease)
+            if os.path.exists(member_file + '.part'):
+                os.remove(member_file + '.part')
+        try:
+            member_df = pd.read_excel(member_file)
+        except Exception:
+            # The export is sometimes a CSV with an .xlsx name
+            member_df = pd.read_csv(member_file)
+        if 'isMember' not in member_df.columns or 'ASIN' not in member_df.columns:
+            # Raised rather than read as "no members", which would be cached for every ASIN in the chunk
+            raise StepError(f"Membership export {os.path.basename(member_file)} has no 'isMember' or 'ASIN' column.", FAULT_DOWNLOAD)
+        is_member = member_df['isMember'].astype(str).str.strip().str.lower() == 'yes'
+        return set(member_df.loc[is_member, 'ASIN'].astype(str).str.strip().str.upper())
+
+    async def select_program(self, page, label):
+        dropdown_trigger = page.locator('#awsui-multiselect-0-textbox, input[placeholder*="Program"]').first
+        try:
+            await self.timed('program_dropdown', lambda timeout: dropdown_trigger.click(timeout=timeout))
+        except Exception as e:
+            raise StepError(f"Could not open the Programs dropdown: {str(e)}", classify_error(e, page.url)) from e
+        search_input = page.locator('#awsui-input-0')
+        await search_input.fill(label)
+        option = page.locator('.awsui-select-option-label-content', has_text=re.compile(f"^\\s*{re.escape(label)}\\s*$", re.IGNORECASE)).first
+        try:
+            # May legitimately be missing (label mismatch), which the fallback handles
+            await option.wait_for(state="visible", timeout=self.timeouts.timeout('program_option'))
+            await option.click()
+        except Exception:
+            self.update_log(f"Could not find '{label}' option by text, using ArrowDown+Enter fallback.")
+            await search_input.focus()
+            await page.keyboard.press('ArrowDown')
+            await page.keyboard.press('Enter')
+
+    def program_option_changed(self, value=None):
+        self.settings['program_filter'] = self.program_var.get()
+        self.persist_settings()
+
+    async def run_step(self, name, action, page=None, recover=None, policy=None):
+        """
+        Runs `await action()` under the retry policy. Each failure is classified,
+        counted towards the circuit breaker and followed by exponential backoff and
+        `await recover()` before the next attempt. Raises StepError once the attempt
+        budget for the fault class is used up.
+        """
+        policy = policy or self.retry_policy
+        attempt = 0
+        reauthenticated = False
+        while True:
+            if self.circuit_breaker.is_open:
+                self.update_log(f"Circuit breaker open, waiting before '{name}'...")
+                self.set_worker_step("Paused, backend looks degraded")
+            await self.circuit_breaker.wait()
+            if page and not self.auth_ok.is_set():
+                if not await self.reauthenticate(page, self.auth_generation):
+                    raise StepError(f"{name} skipped: SSO session has expired.", FAULT_AUTH_EXPIRED)
+                await self._recover_step(name, recover)
+            auth_generation = self.auth_generation
+            attempt += 1
+            try:
+                result = await action()
+                self.circuit_breaker.record_success()
+                return result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                fault = classify_error(e, page.url if page else '')
+                self.retry_counts[fault] += 1
+                METRICS.inc('xcp_retries_total', fault=fault)
+                if fault == FAULT_AUTH_EXPIRED and page and not reauthenticated:
+                    # Expired sessions don't use up the attempt budget, the step is run again once logged in
+                    reauthenticated = True
+                    if await self.reauthenticate(page, auth_generation):
+                        attempt -= 1
+                        await self._recover_step(name, recover)
+                        continue
+                if fault != FAULT_AUTH_EXPIRED and self.circuit_breaker.record_failure():
+                    self.update_log(f"{self.circuit_breaker.failures} steps failed in a row, pausing all work for {self.circuit_breaker.cooldown:.0f} seconds.")
+                if attempt >= policy.attempts_for(fault):
+                    raise StepError(f"{name} failed after {attempt} attempt(s) ({fault}): {str(e)}", fault) from e
+                delay = policy.backoff(attempt)
+                self.update_log(f"{name}: attempt {attempt} failed ({fault}): {str(e)}. Retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                await self._recover_step(name, recover)
+
+    async def _recover_step(self, name, recover):
+        if not recover:
+            return
+        try:
+            await recover()
+        except Exception as e:
+            self.update_log(f"{name}: recovery failed: {str(e)}")
+
+    async def close_browser(self, playwright, context, browser):
+        if browser or context:
+            try:
+                # The context goes first so a HAR recording is written; for a persistent
+                # profile there is no separate browser and this shuts Chromium down
+                if context:
+                    await context.close()
+                if browser:
+                    await browser.close()
+                self.update_log("Browser closed")
+            except Exception as e:
+                logging.error(f"Error closing browser: {str(e)}")
+        if self.har_file and os.path.exists(self.har_file):
+            self.scrub_recorded_har()
+        if self.profile is not None:
+            self.profile.release()
+            self.profile = None
+        if playwright:
+            await playwright.stop()
+
+    async def close_warm_session(self):
+        if self.warm_session is not None:
+            playwright, context, browser, _ = self.warm_session
+            self.warm_session = None
+            await self.close_browser(playwright, context, browser)
+
+    async def warm_session_usable(self):
+        """Checks the kept browser is still connected and gives it an open page."""
+        playwright, context, browser, page = self.warm_session
+        if browser is not None and not browser.is_connected():
+            return False
+        if page.is_closed():
+            try:
+                page = await context.new_page()
+            except Exception:
+                return False
+            self.warm_session = (playwright, context, browser, page)
+        return True
+
+    async def keep_session_alive(self):
+        """Reloads the class search page of the idle browser so the SSO session does not lapse."""
+        page = self.warm_session[3]
+        try:
+            await page.goto(self.CLASS_SEARCH_URL, wait_until="domcontentloaded")
+        except Exception as e:
+            self.update_log(f"Idle browser did not respond, it will be restarted for the next job: {str(e)}")
+            await self.close_warm_session()
+            return
+        if is_auth_url(page.url):
+            self.update_log("SSO session expired while idle. Sign in again in the browser window to keep the next job fast.")
+
+    def watch_session(self, page):
+        """
+        Session watchdog: marks the session as expired as soon as any navigation of
+        `page` lands on the SSO login, so no further step starts until it is restored.
+        """
+        def on_navigated(frame):
+            if frame == page.main_frame and is_auth_url(frame.url) and self.auth_ok.is_set():
+                self.auth_ok.clear()
+                self.update_log("SSO redirect detected, pausing work until the session is restored.")
+        page.on("framenavigated", on_navigated)
+
+    async def launch_browser(self, playwright):
+        """
+        Starts Chromium and returns (context, browser). With 'Keep browser cache'
+        the context runs on this worker's persistent profile and browser is None;
+        otherwise it is a fresh context that starts from the saved session state.
+        """
+        launch_args = ['--start-maximized']
+        storage_state = self.AUTH_STATE_FILE if os.path.exists(self.AUTH_STATE_FILE) else None
+        network = self.network_var.get()
+        self.har_file = None
+        if self.profile_var.get() and network == "Live":
+            context = await self.launch_persistent_profile(playwright, launch_args, storage_state)
+            if context is not None:
+                return context, None
+        browser = await playwright.chromium.launch(headless=False, args=launch_args)
+        if network == "Record HAR":
+            os.makedirs(HAR_DIR, exist_ok=True)
+            self.har_file = os.path.join(HAR_DIR, f"run_{self.run_id}.har")
+            context = await browser.new_context(
+                viewport=None, storage_state=storage_state, record_har_path=self.har_file,
+                record_har_content='embed', record_har_url_filter=HAR_URL_FILTER,
+            )
+            self.update_log(f"Recording CP Central traffic to {self.har_file}")
+        elif network == "Replay HAR":
+            if not self.replay_har or not os.path.exists(self.replay_har):
+                await browser.close()
+                raise FileNotFoundError("Choose a recorded HAR file to replay first.")
+            context = await browser.new_context(viewport=None)
+            # Requests that were not recorded fail instead of going to the live site
+            await context.route_from_har(self.replay_har, url=HAR_URL_FILTER, not_found='abort')
+            self.update_log(f"Replaying CP Central traffic from {self.replay_har}")
+        else:
+            context = await browser.new_context(viewport=None, storage_state=storage_state)
+        self.run_info['network'] = network
+        self.run_info['har_file'] = self.har_file or (self.replay_har if network == "Replay HAR" else None)
+        return context, browser
+
+    async def launch_persistent_profile(self, playwright, launch_args, storage_state):
+        removed = prune_profiles(max_age_days=float(self.settings.get('profile_max_age_days', 30)))
+        if removed:
+            self.update_log(f"Removed browser profiles unused for a while: {removed}")
+        # A second tool running on the same machine gets its own profile
+        for slot in range(1, 5):
+            profile = BrowserProfile(self.WORKER_NAME if slot == 1 else f"{self.WORKER_NAME} {slot}")
+            if profile.acquire():
                 break
-            self.update_log(f"Attempt {attempt}: Could not find class input for '{class_name}'. Reloading class search page...")
-            await page.goto(class_search_url, wait_until="domcontentloaded")
-            await page.wait_for_timeout(1500)
         else:
-            self.update_log(f"Failed to find class input for '{class_name}' after {max_retries} attempts. Skipping class.")
+            self.update_log("All browser profiles are in use, starting with an empty browser cache.")
+            return None
+        self.profile = profile
+        for attempt in range(2):
+            try:
+                context = await playwright.chromium.launch_persistent_context(
+                    profile.path, headless=False, args=launch_args, viewport=None
+                )
+                break
+            except Exception as e:
+                if attempt:
+                    self.update_log(f"Could not open browser profile {profile.name}, starting with an empty browser cache: {str(e)}")
+                    profile.release()
+                    self.profile = None
+                    return None
+                self.update_log(f"Browser profile {profile.name} could not be opened, resetting it: {str(e)}")
+                profile.reset()
+        if not profile.existed and storage_state:
+            try:
+                with open(storage_state, 'r', encoding='utf-8') as f:
+                    await context.add_cookies(json.load(f).get('cookies', []))
+            except Exception as e:
+                self.update_log(f"Saved session state could not be used: {str(e)}")
+        self.update_log(f"Using persistent browser profile '{profile.name}'" + (" (warm cache)." if profile.existed else " (new)."))
+        return context
+
+    def network_option_changed(self, value=None):
+        if self.network_var.get() != "Replay HAR":
             return
-        await input_box.scroll_into_view_if_needed()
-        await input_box.focus()
-        await page.wait_for_timeout(100)
-        await input_box.fill('')
-        await input_box.type(class_name, delay=30)
-        await page.keyboard.press('Enter')
-        await page.wait_for_timeout(500)
+        har_file = filedialog.askopenfilename(
+            initialdir=HAR_DIR if os.path.isdir(HAR_DIR) else APP_DIR,
+            filetypes=[("HAR files", "*.har")]
+        )
+        if har_file:
+            self.replay_har = har_file
+            self.update_log(f"Runs will replay {har_file}")
+        else:
+            self.network_var.set("Live")
+
+    def scrub_recorded_har(self):
+        try:
+            redacted = scrub_har(self.har_file)
+            self.update_log(f"Saved network recording {self.har_file} ({redacted} secret values redacted)")
+        except Exception as e:
+            # An unscrubbed recording must not be left behind
+            self.update_log(f"Could not scrub {self.har_file}, deleting it: {str(e)}")
+            try:
+                os.remove(self.har_file)
+            except OSError:
+                pass
+
+    def profile_option_changed(self):
+        self.settings['persistent_profile'] = bool(self.profile_var.get())
+        self.persist_settings()
+
+    async def save_auth_state(self, context):
+        if self.network_var.get() == "Replay HAR":
+            # A replayed session has no real cookies to keep
+            return
+        try:
+            await context.storage_state(path=self.AUTH_STATE_FILE)
+        except Exception as e:
+            self.update_log(f"Could not save browser session state: {str(e)}")
+
+    async def reauthenticate(self, page, generation):
+        """
+        Restores an expired SSO session. Only one caller logs in again; anyone else
+        waiting on the lock sees the newer generation and carries on.
+        Tries the saved session state first, then waits for an interactive login.
+        Returns True once the session is valid again.
+        """
+        async with self.reauth_lock:
+            if self.auth_generation != generation and self.auth_ok.is_set():
+                return True
+            self.auth_ok.clear()
+            self.update_status("Re-authenticating...")
+            self.set_worker_step("Re-authenticating")
+            context = page.context
+            restored = False
+            if os.path.exists(self.AUTH_STATE_FILE):
+                try:
+                    with open(self.AUTH_STATE_FILE, 'r', encoding='utf-8') as f:
+                        await context.add_cookies(json.load(f).get('cookies', []))
+                    await page.goto(self.CLASS_SEARCH_URL, wait_until="domcontentloaded")
+                    await self.timed('page_load', lambda timeout: page.wait_for_selector('#awsui-input-0', timeout=timeout))
+                    restored = not is_auth_url(page.url)
+                except Exception as e:
+                    self.update_log(f"Saved session state could not be used: {str(e)}")
+            if not restored:
+                self.update_log("SSO session expired. Please complete the login in the browser window to resume.")
+                try:
+                    if not is_auth_url(page.url):
+                        await page.goto(self.CLASS_SEARCH_URL, wait_until="domcontentloaded")
+                    await page.wait_for_selector('#awsui-input-0', timeout=0)
+                except Exception as e:
+                    self.update_log(f"Re-authentication failed: {str(e)}")
+                    self.update_status("Processing...")
+                    return False
+            await self.save_auth_state(context)
+            self.auth_generation += 1
+            self.auth_ok.set()
+            self.update_status("Processing...")
+            self.update_log("SSO session restored, resuming work.")
+            return True
+
+    async def process_class(self, class_search_url, class_name, batches, export_dir, next_class=None):
+        """
+        Tests and exports the batches of a class (all of its marketplaces) in one pass.
+        `batches` is a list of (marketplace_id, batch_num, total_batches, asins) as built
+        by plan_work. Batches run on the active page of self.page_pool. While a test is
+        running the standby page preloads the form of the next batch, which is this
+        class again or `next_class` after the last batch. Returns the batches that
+        still failed after retries.
+        """
+        pool = self.page_pool
+        preload = self.settings.get('preload_next_class', True)
+        failed_batches = []
+        for index, batch in enumerate(batches):
+            if self.draining:
+                self.update_log(f"Finishing up: {len(batches) - index} batch(es) of class {class_name} not started.")
+                failed_batches.extend(batches[index:])
+                break
+            marketplace_id, batch_num, total_batches, batch_asins = batch
+            export_name = f"{class_name}_{marketplace_id}_batch{batch_num}" if marketplace_id else f"{class_name}_batch{batch_num}"
+            marketplace_text = f" ({marketplace_id})" if marketplace_id else ""
+            upcoming_class = class_name if index + 1 < len(batches) else next_class
+            self.update_log(f"Processing batch {batch_num}/{total_batches} for class {class_name}{marketplace_text} with {len(batch_asins)} ASINs.")
+
+            async def run_batch():
+                step = f"{class_name}{marketplace_text} batch {batch_num}/{total_batches}"
+                self.set_worker_step(f"{step} - opening class")
+                started = time.monotonic()
+                if await pool.take(class_name):
+                    self.update_log(f"Using the preloaded form of class {class_name}.")
+                else:
+                    if pool.active.url != class_search_url:
+                        await pool.active.goto(class_search_url, wait_until="domcontentloaded")
+                    await self.open_class_test_form(pool.active, class_search_url, class_name)
+                self.record_step('open_class', started)
+                page = pool.active
+                self.set_worker_step(f"{step} - entering {len(batch_asins)} ASINs")
+                started = time.monotonic()
+                await self.input_asins(page, batch_asins)
+                self.record_step('input_asins', started)
+                if self.governor is not None:
+                    self.set_worker_step(f"{step} - waiting for a test slot")
+                    self.test_lease = await self.acquire_slot('test')
+                test_started = None
+                try:
+                    test_started = await self.click_test_sample_asins(page)
+                    if preload and upcoming_class and self.auth_ok.is_set() and not self.draining:
+                        # Hide the next navigation behind this test's server-side run time
+                        pool.prefetch(upcoming_class, self.preload_class_form)
+                    self.set_worker_step(f"{step} - waiting for test results")
+                    await self.wait_for_test_results(page, test_started)
+                except Exception:
+                    # A test that timed out or failed still took this long; without it the
+                    # governor never backs off on the worst latencies
+                    self.release_test_slot(time.monotonic() - test_started if test_started is not None else None)
+                    raise
+                finally:
+                    self.release_test_slot()
+                return page
+
+            async def reload_class_search():
+                await pool.active.goto(class_search_url, wait_until="domcontentloaded")
+
+            if self.tracer is not None:
+                await self.tracer.begin_item()
+            try:
+                page = await self.run_step(f"Batch {batch_num}/{total_batches} of class {class_name}{marketplace_text}", run_batch, pool.active, recover=reload_class_search)
+                # The export is retried on its own: the results stay on the page, so a
+                # failed download doesn't run the server-side test again
+                self.set_worker_step(f"{class_name}{marketplace_text} batch {batch_num}/{total_batches} - exporting")
+                await self.run_step(
+                    f"Export of batch {batch_num}/{total_batches} of class {class_name}{marketplace_text}",
+                    lambda: self.export_results(page, export_name, export_dir, marketplace_id, source_class=class_name),
+                    page)
+                if self.tracer is not None:
+                    await self.tracer.end_item()
+                self.metrics.record_batch(len(batch_asins))
+                METRICS.inc('xcp_batches_done_total')
+                METRICS.inc('xcp_asins_done_total', len(batch_asins))
+            except StepError as e:
+                self.update_log(str(e))
+                METRICS.inc('xcp_batches_failed_total')
+                await self.save_failure_trace(pool.active, export_name, export_dir)
+                failed_batches.append(batch)
+                if e.fault == FAULT_AUTH_EXPIRED:
+                    # Everything after this would fail the same way
+                    failed_batches.extend(batches[index + 1:])
+                    await pool.cancel()
+                    break
+                await reload_class_search()
+            finally:
+                await self.sample_browser_memory(pool.active)
+        return failed_batches
+
+    async def timed(self, step, action):
+        """
+        Runs `await action(timeout_ms)` with the learned timeout of `step` and adds
+        how long it took to the step's latency history. A timeout backs the step's
+        timeout off instead, so only use this for waits whose target must appear.
+        """
+        timeout = self.timeouts.timeout(step)
+        METRICS.set('xcp_step_timeout_ms', timeout, step=step)
+        started = time.monotonic()
+        try:
+            result = await action(timeout)
+        except Exception as e:
+            if classify_error(e) == FAULT_SELECTOR_TIMEOUT:
+                self.timeouts.timed_out(step)
+            raise
+        self.timeouts.observe(step, time.monotonic() - started)
+        return result
+
+    def save_latency_history(self):
+        try:
+            self.timeouts.save()
+        except OSError as e:
+            self.update_log(f"Could not save step latency history: {str(e)}")
+
+    def open_governor(self):
+        try:
+            self.governor = BackendGovernor(
+                limits=self.settings.get('governor_limits'),
+                target_latency=float(self.settings.get('governor_target_latency', 60)),
+            )
+        except Exception as e:
+            self.governor = None
+            self.update_log(f"Backend governor not available, running without rate limits: {str(e)}")
+
+    async def acquire_slot(self, kind):
+        if self.governor is None:
+            return None
+        started = time.monotonic()
+        lease = await self.governor.acquire(kind)
+        waited = time.monotonic() - started
+        if waited >= 1:
+            METRICS.inc('xcp_governor_wait_seconds_total', waited, kind=kind)
+            self.update_log(f"Waited {waited:.1f}s for a free {kind} slot.")
+        return lease
+
+    def release_slot(self, lease):
+        if self.governor is not None and lease is not None:
+            try:
+                self.governor.release(lease)
+            except sqlite3.Error as e:
+                # The lease expires by itself
+                logging.warning(f"Could not release governor lease: {str(e)}")
+
+    def release_test_slot(self, latency=None):
+        """Frees the running test's slot; a measured latency also adjusts the in-flight limit."""
+        lease, self.test_lease = self.test_lease, None
+        if lease is None:
+            return
+        self.release_slot(lease)
+        if latency is not None:
+            try:
+                limit = self.governor.observe('test', latency)
+                if latency > self.governor.target_latency:
+                    self.update_log(f"Test latency {latency:.0f}s is above {self.governor.target_latency:.0f}s, allowing {int(limit)} test(s) in flight.")
+            except sqlite3.Error as e:
+                logging.warning(f"Could not update governor limit: {str(e)}")
+
+    async def save_failure_trace(self, page, item_name, export_dir):
+        """Saves the trace of the failed item and a screenshot of its page under failures/<run id>."""
+        if self.tracer is None:
+            return
+        failure_dir = os.path.join(export_dir, 'failures', self.run_id)
+        os.makedirs(failure_dir, exist_ok=True)
+        base = os.path.join(failure_dir, f"{item_name.replace('/', '_').replace(' ', '_')}_{datetime.datetime.now().strftime('%H%M%S')}")
+        try:
+            await page.screenshot(path=base + '.png', full_page=True)
+        except Exception as e:
+            logging.warning(f"Could not take failure screenshot: {str(e)}")
+        trace = await self.tracer.end_item(base + '.zip')
+        if trace:
+            self.update_log(f"Trace of the failed batch saved to {trace} (open with: playwright show-trace)")
+
+    def log_tracing_report(self):
+        report = self.tracer.report()
+        if report['overhead_percent'] is None:
+            overhead = "not measured yet"
+        else:
+            overhead = f"{report['overhead_percent']:+.1f}% on browser steps vs {report['untraced_items']} untraced batches"
+        self.update_log(
+            f"Tracing over {report['items']} batches: {overhead}, {report['chunk_seconds']:.1f}s starting and stopping chunks, "
+            f"{report['traces_saved']} failure trace(s) saved."
+        )
+
+    def trace_option_changed(self):
+        self.settings['trace_failures'] = bool(self.trace_var.get())
+        self.persist_settings()
+
+    async def preload_class_form(self, page, class_name):
+        await page.goto(self.CLASS_SEARCH_URL, wait_until="domcontentloaded")
+        await self.open_class_test_form(page, self.CLASS_SEARCH_URL, class_name)
+
+    async def open_class_test_form(self, page, class_search_url, class_name):
+        """
+        Searches for the class, opens it and gets to the 'New sample ASINs test' form.
+        """
+        input_box = page.locator('input[placeholder*="class name"]')
+        if not await self.wait_for_visible_enabled(input_box, page):
+            raise StepError(f"Could not find class input for '{class_name}'.", FAULT_SELECTOR_TIMEOUT)
+        class_link = await self.enter_class_search(page, input_box, class_name)
         self.update_log(f"Class name '{class_name}' entered successfully.")
         # Click class link
-        class_link = page.locator(f"a:text-is('{class_name}')")
-        await class_link.first.wait_for(timeout=5000)
-        await class_link.first.click()
+        await class_link.click()
         await page.wait_for_timeout(1000)
         # Click 'New sample ASINs test'
         await self.click_sample_test_btn(page)
@@ -392,49 +2900,34 @@ class XCPToolGUI(ctk.CTk):
         # Uncheck box
         await self.uncheck_sample_asins_box(page)
         await page.wait_for_timeout(500)
-        # Input ASINs in batches of 900
-        asins = group['asin_id'].astype(str).tolist()
-        batch_size = 900
-        total_batches = (len(asins) + batch_size - 1) // batch_size
-        # Get marketplace_id once for this group
-        marketplace_id = group['marketplace_id'].iloc[0] if 'marketplace_id' in group.columns else None
-        for batch_num, i in enumerate(range(0, len(asins), batch_size), 1):
-            batch_asins = asins[i:i+batch_size]
-            self.update_log(f"Processing batch {batch_num}/{total_batches} for class {class_name} with {len(batch_asins)} ASINs.")
-            await self.input_asins(page, batch_asins)
-            await self.click_test_sample_asins(page)
-            # Marketplace selection will now happen inside export_results
-            await self.export_results(page, f"{class_name}_batch{batch_num}", export_dir, class_search_url, marketplace_id)
-            if batch_num < total_batches:
-                await page.goto(class_search_url, wait_until="domcontentloaded")
-                await page.wait_for_timeout(1000)
-                # Re-enter class for next batch (with retry)
-                for attempt in range(1, max_retries + 1):
-                    input_box = page.locator('input[placeholder*="class name"]')
-                    found = await self.wait_for_visible_enabled(input_box, page)
-                    if found:
-                        break
-                    self.update_log(f"Attempt {attempt}: Could not find class input for '{class_name}' on batch {batch_num+1}. Reloading class search page...")
-                    await page.goto(class_search_url, wait_until="domcontentloaded")
-                    await page.wait_for_timeout(1500)
-                else:
-                    self.update_log(f"Failed to find class input for '{class_name}' on batch {batch_num+1} after {max_retries} attempts. Skipping remaining batches.")
-                    break
-                await input_box.scroll_into_view_if_needed()
-                await input_box.focus()
-                await page.wait_for_timeout(100)
-                await input_box.fill('')
-                await input_box.type(class_name, delay=30)
-                await page.keyboard.press('Enter')
-                await page.wait_for_timeout(500)
-                class_link = page.locator(f"a:text-is('{class_name}')")
-                await class_link.first.wait_for(timeout=5000)
-                await class_link.first.click()
-                await page.wait_for_timeout(1000)
-                await self.click_sample_test_btn(page)
-                await page.wait_for_timeout(1000)
-                await self.uncheck_sample_asins_box(page)
-                await page.wait_for_timeout(500)
+
+    async def enter_class_search(self, page, input_box, class_name):
+        """
+        Enters the class name into the search box and waits for the exact class link
+        in the results list. The value is set in one go with fill(); typing character
+        by character is only used when the search box does not accept the filled value
+        or the search does not return the class.
+        """
+        class_link = page.locator(f"a:text-is('{class_name}')").first
+        await input_box.scroll_into_view_if_needed()
+        await input_box.fill(class_name)
+        if await input_box.input_value() == class_name:
+            await input_box.press('Enter')
+            # Not run through timed(): a miss here is expected now and then and is no timeout of the step
+            started = time.monotonic()
+            try:
+                await class_link.wait_for(state="visible", timeout=self.timeouts.timeout('class_link'))
+                self.timeouts.observe('class_link', time.monotonic() - started)
+                return class_link
+            except Exception:
+                pass
+        self.update_log(f"Search box did not accept '{class_name}' directly, typing it instead.")
+        await input_box.focus()
+        await input_box.fill('')
+        await input_box.type(class_name, delay=30)
+        await page.keyboard.press('Enter')
+        await self.timed('class_link', lambda timeout: class_link.wait_for(state="visible", timeout=timeout))
+        return class_link
 
     async def wait_for_visible_enabled(self, locator, page, retries=15, delay=200):
         for _ in range(retries):
@@ -447,94 +2940,195 @@ class XCPToolGUI(ctk.CTk):
         return False
 
     async def click_sample_test_btn(self, page):
+        btn = await self.timed('sample_test_button', lambda timeout: self.selectors.resolve(page, 'sample_test_button', timeout=timeout))
         try:
-            btn = page.locator('#app-content > div > div > div:nth-child(1) > div > div.awsui-util-action-stripe-large > div.awsui-util-action-stripe-group.awsui-util-pv-n > awsui-button:nth-child(1) > a')
-            await btn.wait_for(timeout=5000)
             await btn.click()
-        except Exception:
-            try:
-                btn = page.locator('xpath=//*[@id="app-content"]/div/div/div[1]/div/div[2]/div[2]/awsui-button[1]/a')
-                await btn.wait_for(timeout=2000)
-                await btn.click()
-            except Exception as e:
-                self.update_log(f"Could not click 'New sample ASINs test' button: {str(e)}")
+        except Exception as e:
+            raise StepError(f"Could not click 'New sample ASINs test' button: {str(e)}", classify_error(e, page.url)) from e
 
     async def uncheck_sample_asins_box(self, page):
+        label_text = 'Include sample ASINs provided during the class authoring process'
+        checkboxes = page.locator('input[type="checkbox"]')
+        # Many forms have no checkbox at all, so wait for the ASIN box every form has
+        # and look at the checkboxes rendered with it instead of waiting for one
+        asin_box = page.locator('textarea[placeholder^="Enter ASIN"]').first
         try:
-            checkbox = page.locator('input[type="checkbox"]')
-            label = await checkbox.evaluate_handle('el => el.parentElement.textContent')
-            if 'Include sample ASINs provided during the class authoring process' in await label.json_value():
+            await self.timed('asin_textarea', lambda timeout: asin_box.wait_for(state="visible", timeout=timeout))
+        except Exception as e:
+            raise StepError(f"The sample ASINs test form did not load: {str(e)}", classify_error(e, page.url)) from e
+        for idx in range(await checkboxes.count()):
+            checkbox = checkboxes.nth(idx)
+            if label_text in (await checkbox.evaluate('el => el.parentElement.textContent') or ''):
                 if await checkbox.is_checked():
-                    await checkbox.click()
+                    try:
+                        await checkbox.click()
+                    except Exception as e:
+                        raise StepError(f"Could not uncheck the 'Include sample ASINs' box: {str(e)}", classify_error(e, page.url)) from e
                     self.update_log("Unchecked the 'Include sample ASINs' box.")
-        except Exception as e:
-            self.update_log(f"Could not uncheck the box: {str(e)}")
+                return
+        self.update_log("'Include sample ASINs' box not found on the form, leaving it as is.")
 
     async def input_asins(self, page, asins):
-        # Retry logic for filling ASINs
-        for attempt in range(3):
-            try:
-                await page.wait_for_selector('textarea[placeholder^="Enter ASIN"]', timeout=10000)
-                asin_inputs = page.locator('textarea[placeholder^="Enter ASIN"]')
-                count = await asin_inputs.count()
-                asin_input_area = None
-                asin_input_index = 0
-                if count > 1:
-                    ids = []
-                    for idx in range(count):
-                        handle = asin_inputs.nth(idx)
-                        id_val = await handle.get_attribute('id')
-                        ids.append(id_val)
-                    self.update_log(f"Found {count} ASIN textareas with ids: {ids}")
-                    for idx in range(count):
-                        handle = asin_inputs.nth(idx)
-                        visible = await handle.is_visible()
-                        enabled = await handle.is_enabled()
-                        if visible and enabled:
-                            asin_input_area = handle
-                            asin_input_index = idx
-                            break
-                else:
-                    asin_input_area = asin_inputs.first
-                asin_text = '\n'.join(asins)
-                await asin_input_area.fill(asin_text, timeout=20000)
-                self.update_log(f"Filled ASINs textarea (index {asin_input_index}) with {len(asins)} ASINs.")
-                await page.wait_for_timeout(500)
-                return
-            except Exception as e:
-                self.update_log(f"Attempt {attempt+1}: Could not input ASINs: {str(e)}")
-                await page.reload()
-                await page.wait_for_timeout(1000)
-        self.update_log("Failed to input ASINs after 3 attempts.")
+        try:
+            await self.timed('asin_textarea', lambda timeout: page.wait_for_selector('textarea[placeholder^="Enter ASIN"]', timeout=timeout))
+            asin_inputs = page.locator('textarea[placeholder^="Enter ASIN"]')
+            count = await asin_inputs.count()
+            asin_input_area = None
+            asin_input_index = 0
+            if count > 1:
+                ids = []
+                for idx in range(count):
+                    handle = asin_inputs.nth(idx)
+                    id_val = await handle.get_attribute('id')
+                    ids.append(id_val)
+                self.update_log(f"Found {count} ASIN textareas with ids: {ids}")
+                for idx in range(count):
+                    handle = asin_inputs.nth(idx)
+                    visible = await handle.is_visible()
+                    enabled = await handle.is_enabled()
+                    if visible and enabled:
+                        asin_input_area = handle
+                        asin_input_index = idx
+                        break
+                if asin_input_area is None:
+                    raise StepError(f"None of the {count} ASIN textareas is visible and enabled.", FAULT_SELECTOR_TIMEOUT)
+            else:
+                asin_input_area = asin_inputs.first
+            asin_text = '\n'.join(asins)
+            await self.timed('asin_fill', lambda timeout: asin_input_area.fill(asin_text, timeout=timeout))
+            self.update_log(f"Filled ASINs textarea (index {asin_input_index}) with {len(asins)} ASINs.")
+            await page.wait_for_timeout(500)
+        except StepError:
+            raise
+        except Exception as e:
+            raise StepError(f"Could not input ASINs: {str(e)}", classify_error(e, page.url)) from e
 
     async def click_test_sample_asins(self, page):
+        """
+        Clicks 'Test sample ASINs' and returns the time the test was started.
+        """
+        test_btn = await self.timed('test_button', lambda timeout: self.selectors.resolve(page, 'test_button', timeout=timeout))
         try:
-            test_btn = page.locator('button:has(span:text("Test sample ASINs")), button:has-text("Test sample ASINs")')
-            await test_btn.wait_for(timeout=5000)
             await test_btn.click()
             self.update_log("Clicked 'Test sample ASINs' button.")
         except Exception as e:
-            self.update_log(f"Could not click 'Test sample ASINs' button: {str(e)}")
+            raise StepError(f"Could not click 'Test sample ASINs' button: {str(e)}", classify_error(e, page.url)) from e
+        return time.monotonic()
 
-    async def export_results(self, page, class_name, export_dir, class_search_url, marketplace_id=None):
+    async def wait_for_export_ready(self, export_btn, timeout=120000):
+        """
+        Waits until the export button is visible and enabled, i.e. the test results have loaded.
+        Enablement is detected by a MutationObserver in the page instead of polling, and the
+        whole wait is bounded by `timeout` ms. Raises ExportNotReadyError when the deadline passes.
+        """
+        deadline = time.monotonic() + timeout / 1000
+        try:
+            await export_btn.wait_for(state="visible", timeout=timeout)
+            while True:
+                remaining = int((deadline - time.monotonic()) * 1000)
+                if remaining <= 0:
+                    raise ExportNotReadyError(f"Export button not enabled after {timeout / 1000:.0f} seconds.")
+                state = await export_btn.evaluate(
+                    """(btn, timeoutMs) => new Promise(resolve => {
+                        const ready = () => !btn.disabled && btn.getAttribute('aria-disabled') !== 'true';
+                        if (ready()) return resolve('ready');
+                        const observer = new MutationObserver(() => {
+                            if (!btn.isConnected) finish('detached');
+                            else if (ready()) finish('ready');
+                        });
+                        const timer = setTimeout(() => finish('timeout'), timeoutMs);
+                        function finish(result) {
+                            observer.disconnect();
+                            clearTimeout(timer);
+                            resolve(result);
+                        }
+                        observer.observe(document.body, {attributes: true, childList: true, subtree: true});
+                    })""",
+                    remaining,
+                    timeout=remaining,
+                )
+                if state == 'ready':
+                    return
+                # 'detached' means the results table re-rendered, observe the new button
+        except ExportNotReadyError:
+            raise
+        except Exception as e:
+            raise ExportNotReadyError(f"Export button did not become available: {str(e)}") from e
+
+    def log_test_latency_summary(self):
+        if not self.test_latencies:
+            return
+        latencies = sorted(self.test_latencies)
+        median = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.update_log(
+            f"Sample ASIN test latency over {len(latencies)} batches: "
+            f"median {median:.1f}s, p95 {p95:.1f}s, max {latencies[-1]:.1f}s."
+        )
+
+    async def wait_for_test_results(self, page, test_started=None):
+        """
+        Waits until the export button is enabled, which is when the server-side test
+        of the entered ASINs has finished, and records how long the test took.
+        """
         try:
-            export_btn = page.locator('#app-content > div > div:nth-child(3) > div.test-sample-asins-component > div:nth-child(4) > awsui-table > div > div.awsui-table-heading-container > div > div.awsui-table-header > span > div > div.awsui-util-action-stripe-group > awsui-button > button')
             # Wait for export button to be visible and enabled (ASIN test results loaded)
-            await export_btn.wait_for(state="visible", timeout=120000)
+            timeout = self.timeouts.timeout('export_ready')
+            METRICS.set('xcp_step_timeout_ms', timeout, step='export_ready')
+            waiting_since = test_started if test_started is not None else time.monotonic()
+            deadline = waiting_since + timeout / 1000
+            try:
+                try:
+                    export_btn = await self.selectors.resolve(page, 'export_button', timeout=max(int((deadline - time.monotonic()) * 1000), 1000))
+                except StepError as e:
+                    raise ExportNotReadyError(str(e)) from e
+                await self.wait_for_export_ready(export_btn, timeout=max(int((deadline - time.monotonic()) * 1000), 1000))
+            except ExportNotReadyError:
+                self.timeouts.timed_out('export_ready')
+                raise
+            export_started = time.monotonic()
+            self.timeouts.observe('export_ready', export_started - waiting_since)
+            if test_started is not None:
+                latency = self.record_step('test', test_started)
+                self.test_latencies.append(latency)
+                self.release_test_slot(latency)
+                self.update_log(f"ASINs tested in {latency:.1f} seconds, export button is now enabled.")
+            else:
+                self.update_log("ASINs tested, export button is now enabled.")
+        except (ExportNotReadyError, StepError):
+            raise
+        except Exception as e:
+            raise StepError(f"Test results did not load: {str(e)}", classify_error(e, page.url)) from e
+
+    async def export_results(self, page, class_name, export_dir, marketplace_id=None, source_class=None):
+        import pandas as pd
+        try:
+            export_btn = await self.timed('export_button', lambda timeout: self.selectors.resolve(page, 'export_button', timeout=timeout))
+            export_started = time.monotonic()
             await export_btn.scroll_into_view_if_needed()
-            while not await export_btn.is_enabled():
-                await page.wait_for_timeout(500)
-            self.update_log("ASINs tested, export button is now enabled.")
             # Now select marketplace (dropdown will be available)
             if marketplace_id:
                 await self.select_marketplace_dropdown(page, marketplace_id)
             await export_btn.hover()
             await page.wait_for_timeout(200)
-            async with page.expect_download() as download_info:
-                await export_btn.click(force=True)
-            download = await download_info.value
             class_export_name = os.path.join(export_dir, f"export_{class_name.replace('/', '_').replace(' ', '_')}.xlsx")
-            await download.save_as(class_export_name)
+            lease = await self.acquire_slot('export')
+            try:
+                async with page.expect_download() as download_info:
+                    await export_btn.click(force=True)
+                download = await download_info.value
+                # Saved under .part until complete, so a stopped run never leaves a truncated export
+                await download.save_as(class_export_name + '.part')
+                os.replace(class_export_name + '.part', class_export_name)
+                size = os.path.getsize(class_export_name)
+                METRICS.observe('xcp_download_bytes', size)
+                self.download_bytes += size
+            except Exception as e:
+                raise StepError(f"Download failed for class {class_name}: {str(e)}", FAULT_DOWNLOAD) from e
+            finally:
+                self.release_slot(lease)
+                if os.path.exists(class_export_name + '.part'):
+                    os.remove(class_export_name + '.part')
             self.update_log(f"Downloaded export for class {class_name} as {class_export_name}")
 
             # Robust conversion to CSV (like FS Pre-filter Export)
@@ -547,68 +3141,371 @@ class XCPToolGUI(ctk.CTk):
                     try:
                         df = pd.read_csv(class_export_name)
                         class_export_csv = class_export_name.replace('.xlsx', '.csv')
-                        df.to_csv(class_export_csv, index=False)
+                        write_csv_atomic(df, class_export_csv)
                         self.update_log(f"Downloaded file was CSV, saved as: {class_export_csv}")
                         try:
                             os.remove(class_export_name)
                         except Exception:
                             pass
                         class_export_name = class_export_csv
+                        self.collate_export(class_export_csv, source_class, marketplace_id)
                     except Exception as e:
                         self.update_log(f"Downloaded file is not Excel or CSV: {str(e)}")
                         return
                 else:
                     class_export_csv = class_export_name.replace('.xlsx', '.csv')
-                    df.to_csv(class_export_csv, index=False)
+                    write_csv_atomic(df, class_export_csv)
                     os.remove(class_export_name)
                     self.update_log(f"Converted export for class {class_name} to CSV: {class_export_csv}")
+                    self.collate_export(class_export_csv, source_class, marketplace_id)
             except Exception as e:
                 self.update_log(f"Could not convert export for class {class_name} to CSV: {str(e)}")
 
-            await page.goto(class_search_url, wait_until="domcontentloaded")
-            self.update_log("Returned to fresh Class Search page for next class.")
+            self.record_step('export', export_started)
+        except (ExportNotReadyError, StepError):
+            raise
         except Exception as e:
-            self.update_log(f"Could not export results for class {class_name}: {str(e)}")
+            raise StepError(f"Could not export results for class {class_name}: {str(e)}", classify_error(e, page.url)) from e
+
+    def log_selector_summary(self):
+        for name, strategies in self.selectors.summary().items():
+            counts = ", ".join(f"{strategy}: {stats['hit']} hit / {stats['miss']} miss" for strategy, stats in strategies.items())
+            self.update_log(f"Selector lookups for {name}: {counts}")
+
+    def save_selector_cache(self):
+        if self.settings.get('selector_cache') != self.selectors.preferred:
+            self.settings['selector_cache'] = dict(self.selectors.preferred)
+            self.persist_settings()
+
+    def record_step(self, step, started):
+        """Records how long a batch step took since `started` (time.monotonic) and returns it."""
+        duration = time.monotonic() - started
+        METRICS.observe('xcp_step_seconds', duration, step=step)
+        self.step_durations.setdefault(step, []).append(duration)
+        if self.tracer is not None:
+            self.tracer.observe_step(step, duration)
+        return duration
+
+    async def sample_browser_memory(self, page):
+        try:
+            heap = await page.evaluate("() => performance.memory ? performance.memory.usedJSHeapSize : 0")
+            METRICS.set('xcp_browser_js_heap_bytes', heap, worker=self.WORKER_NAME)
+        except Exception:
+            pass
+
+    def start_metrics_server(self, port):
+        try:
+            self.metrics_server = MetricsServer(METRICS, self.run_summary_snapshot, port)
+            self.update_log(f"Metrics available on {self.metrics_server.address}/metrics")
+        except OSError as e:
+            self.update_log(f"Could not start metrics endpoint on port {port}: {str(e)}")
+
+    def run_summary_snapshot(self, timeout=5):
+        """
+        Builds the run summary for the metrics thread. It is built on the event loop,
+        where the run adds to the step, retry and selector counters, so they are
+        never read while they change.
+        """
+        import concurrent.futures
+        result = concurrent.futures.Future()
+
+        def build():
+            try:
+                result.set_result(self.build_run_summary())
+            except Exception as e:
+                result.set_exception(e)
+
+        self.loop.call_soon_threadsafe(build)
+        return result.result(timeout)
+
+    def start_run_summary(self, input_file):
+        self.run_info = {
+            'run_id': self.run_id,
+            'input_file': input_file,
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'status': 'stopped',
+        }
+        self.run_started = time.monotonic()
+        self.step_durations = {}
+        self.download_bytes = 0
+        self.run_outputs = []
+        self.membership_counts = Counter()
+        # A run that ends before the browser is up must not report the last run's totals
+        self.metrics = RunMetrics()
+        self.retry_counts = Counter()
+        self.selectors.stats = Counter()
+        METRICS.set('xcp_run_active', 1)
+
+    def build_run_summary(self):
+        metrics = self.metrics
+        summary = dict(self.run_info)
+        summary.update({
+            'duration_seconds': round(time.monotonic() - self.run_started, 1),
+            'classes': {'total': metrics.total_classes, 'done': metrics.done_classes},
+            'asins': {'total': metrics.total_asins, 'done': metrics.done_asins, 'given_up': metrics.skipped_asins},
+            'batches_given_up': metrics.skipped_batches,
+            'retries': dict(self.retry_counts),
+            'governor_wait_seconds': {kind: round(seconds, 1) for kind, seconds in self.governor.waited.items()} if self.governor else None,
+            'tracing': self.tracer.report() if self.tracer else None,
+            'program_filter': dict(self.membership_counts) if self.membership_counts else None,
+            'preloaded_forms': {'used': self.page_pool.hits, 'wasted': self.page_pool.misses} if self.page_pool else None,
+            'selectors': self.selectors.summary(),
+            'step_seconds': {step: latency_stats(durations) for step, durations in self.step_durations.items()},
+            'download_bytes': self.download_bytes,
+            'outputs': list(self.run_outputs),
+        })
+        return summary
+
+    def write_run_summary(self, export_dir):
+        """Writes run_summary_<run id>.json next to the exports for monitoring to pick up."""
+        METRICS.set('xcp_run_active', 0)
+        self.run_info['finished_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+        summary_file = os.path.join(export_dir, f"run_summary_{self.run_id}.json")
+        try:
+            with open(summary_file, 'w', encoding='utf-8') as f:
+                json.dump(self.build_run_summary(), f, indent=2, default=str)
+            self.update_log(f"Run summary saved to {summary_file}")
+        except Exception as e:
+            self.update_log(f"Could not write run summary: {str(e)}")
+
+    def create_collator(self, export_dir):
+        combined_file = os.path.join(export_dir, f"collated_exports_{datetime.date.today()}.csv")
+        return ExportCollator(combined_file, self.sanitize_excel_column)
+
+    def collate_export(self, export_file, class_name=None, marketplace_id=None):
+        """Appends a finished export to the collated output straight away."""
+        if self.collator is None:
+            return
+        try:
+            rows = self.collator.add(export_file, class_name, marketplace_id)
+            self.update_log(f"Collated {rows} rows from {os.path.basename(export_file)}.")
+            self.run_info.setdefault('first_result_seconds', round(time.monotonic() - self.run_started, 1))
+        except Exception as e:
+            self.update_log(f"Could not collate {export_file} yet, it will be retried at the end of the run: {str(e)}")
+        self.store_export(export_file, class_name, marketplace_id)
+
+    def open_results_store(self, input_file):
+        try:
+            self.results_store = ResultsStore()
+            self.results_store.start_run(self.run_id, input_file)
+        except Exception as e:
+            self.results_store = None
+            self.update_log(f"Results store not available, results will only be saved as files: {str(e)}")
+
+    def store_export(self, export_file, class_name=None, marketplace_id=None):
+        if self.results_store is None:
+            return
+        try:
+            self.results_store.add_export(self.run_id, export_file, class_name, marketplace_id)
+        except Exception as e:
+            self.update_log(f"Could not store {os.path.basename(export_file)} in the results store: {str(e)}")
+
+    def open_results_query(self):
+        """Small window to look up stored results by ASIN, class and marketplace."""
+        window = ctk.CTkToplevel(self)
+        window.title("Query Results")
+        window.geometry("900x450")
+        window.grid_columnconfigure(1, weight=1)
+        window.grid_rowconfigure(4, weight=1)
+        entries = {}
+        for row, (key, text) in enumerate([('asin', "ASIN:"), ('class_name', "Class:"), ('marketplace_id', "Marketplace:")]):
+            ctk.CTkLabel(window, text=text).grid(row=row, column=0, padx=10, pady=5, sticky="w")
+            entries[key] = ctk.CTkEntry(window)
+            entries[key].grid(row=row, column=1, padx=10, pady=5, sticky="ew")
+        days_entry = ctk.CTkEntry(window, placeholder_text="Last N days (optional)")
+        days_entry.grid(row=3, column=0, padx=10, pady=5)
+        output = ctk.CTkTextbox(window, font=ctk.CTkFont(size=12))
+        output.grid(row=4, column=0, columnspan=3, padx=10, pady=10, sticky="nsew")
+
+        def run_query():
+            output.delete("1.0", "end")
+            days = days_entry.get().strip()
+            try:
+                store = ResultsStore()
+                try:
+                    started = time.perf_counter()
+                    rows = store.query(days=int(days) if days else None, **{key: entry.get().strip() or None for key, entry in entries.items()})
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                finally:
+                    store.close()
+                output.insert("end", f"{len(rows)} row(s) in {elapsed_ms:.0f} ms\n{format_result_rows(rows)}\n")
+            except Exception as e:
+                output.insert("end", f"Query failed: {str(e)}\n")
+
+        ctk.CTkButton(window, text="Search", command=run_query).grid(row=3, column=1, padx=10, pady=5, sticky="w")
+
+    def save_parquet_dataset(self, collator, export_dir):
+        dataset_dir = os.path.join(export_dir, 'parquet')
+        try:
+            rows = write_parquet_dataset(collator.output_file, dataset_dir, collator.sources, str(datetime.date.today()))
+            self.update_log(f"Saved {rows} rows as Parquet dataset in {dataset_dir}")
+            self.run_outputs.append(dataset_dir)
+        except ImportError:
+            self.update_log("Parquet output needs the 'pyarrow' package (pip install pyarrow). Skipping Parquet dataset.")
+        except Exception as e:
+            self.update_log(f"Error saving Parquet dataset: {str(e)}")
+
+    def parquet_option_changed(self):
+        self.settings['parquet_output'] = bool(self.parquet_var.get())
+        self.persist_settings()
 
     async def collate_exports(self, export_dir):
         try:
-            # Collate all CSV exports in the export_dir
-            all_files = glob.glob(os.path.join(export_dir, 'export_*.csv'))
-            if all_files:
-                dfs = []
-                for file in all_files:
-                    try:
-                        df = pd.read_csv(file)
-                    except Exception:
-                        self.update_log(f"Could not read file {file} as CSV. Skipping.")
-                        continue
-                    # Sanitize all column names
-                    df.columns = [self.sanitize_excel_column(str(col)) for col in df.columns]
-                    df['source_file'] = os.path.basename(file)
-                    dfs.append(df)
-                if dfs:
-                    combined = pd.concat(dfs, ignore_index=True)
-                    # Sanitize again after concat in case of new columns
-                    combined.columns = [self.sanitize_excel_column(str(col)) for col in combined.columns]
-                    # Save as CSV with present date in the export_dir
-                    combined_file = os.path.join(export_dir, f"collated_exports_{datetime.date.today()}.csv")
-                    try:
-                        combined.to_csv(combined_file, index=False)
-                        self.update_log(f"Collated all exports into {combined_file}")
-                    except PermissionError:
-                        self.update_log(f"Permission denied: Could not write to {combined_file}. Please close the file if it is open in Excel or another program and try again.")
-                        messagebox.showerror("Permission Denied", f"Could not write to {combined_file}. Please close the file if it is open in Excel or another program and try again.")
-                    except Exception as e:
-                        self.update_log(f"Error saving collated exports: {str(e)}")
+            # Collate all CSV exports in the export_dir that were not appended during the run
+            collator = self.collator or self.create_collator(export_dir)
+            pending = [file for file in sorted(glob.glob(os.path.join(export_dir, 'export_*.csv'))) if not collator.has(file)]
+            readable = []
+            for file in pending:
+                try:
+                    # Union the schema of everything left before appending any of it
+                    collator.extend_schema(collator.read_columns(file))
+                    readable.append(file)
+                except Exception:
+                    self.update_log(f"Could not read file {file} as CSV. Skipping.")
+            for file in readable:
+                try:
+                    collator.add(file)
+                except Exception as e:
+                    self.update_log(f"Could not collate file {file}: {str(e)}. Skipping.")
+                if self.results_store is not None and not self.results_store.has_source(file):
+                    self.store_export(file)
+            combined_file = collator.output_file
+            try:
+                if collator.finalize():
+                    self.update_log(f"Collated all exports into {combined_file} ({collator.rows} rows)")
+                    self.run_outputs.append(combined_file)
+                    if self.parquet_var.get():
+                        self.save_parquet_dataset(collator, export_dir)
+            except PermissionError:
+                self.update_log(f"Permission denied: Could not write to {combined_file}. Please close the file if it is open in Excel or another program and try again.")
+                self.show_run_error(f"Could not write to {combined_file}. Please close the file if it is open in Excel or another program and try again.", "Permission Denied")
+            except Exception as e:
+                self.update_log(f"Error saving collated exports: {str(e)}")
         except Exception as e:
             self.update_log(f"Error collating exports: {str(e)}")
+        finally:
+            self.collator = None
+            if self.results_store is not None:
+                self.results_store.close()
+                self.results_store = None
 
     def start_processing(self):
         if not self.is_processing:
+            # Allow nested event loops, applied on the first run instead of at import
+            import nest_asyncio
+            nest_asyncio.apply(self.loop)
             self.is_processing = True
+            self.draining = False
             self.start_button.configure(state="disabled")
             self.stop_button.configure(state="normal")
-            self.loop.create_task(self.process_asins())
+            self.drain_button.configure(state="normal")
+            self.run_task = self.loop.create_task(self.process_asins())
+            self.run_task.add_done_callback(self.run_finished)
+
+    def run_finished(self, task):
+        # A run cancelled before its first await never reaches its own cleanup
+        self.is_processing = False
+        self.draining = False
+        self.run_task = None
+        self.reset_buttons()
+
+    def reset_buttons(self):
+        self.start_button.configure(state="disabled" if self.watching else "normal")
+        self.stop_button.configure(state="disabled")
+        self.drain_button.configure(state="disabled")
+
+    def toggle_watch(self):
+        if self.watch_task is None:
+            self.start_watching()
+        else:
+            self.stop_watching()
+
+    def start_watching(self, inbox=None):
+        if self.watch_task is not None:
+            return
+        if self.is_processing:
+            messagebox.showinfo("Watch Inbox", "Wait for the current run to finish before watching the inbox.")
+            return
+        import nest_asyncio
+        nest_asyncio.apply(self.loop)
+        self.watching = True
+        self.watch_button.configure(text="Stop Watching")
+        self.reset_buttons()
+        self.watch_task = self.loop.create_task(self.watch_inbox(inbox or self.settings.get('inbox_dir') or INBOX_DIR))
+
+    def stop_watching(self):
+        """Stops the inbox watch and the job running now; the kept browser is closed."""
+        if self.watch_task is None:
+            return
+        self.watching = False
+        self.update_log("Inbox watch stopped by user")
+        if self.run_task is not None and not self.run_task.done():
+            self.run_task.cancel()
+        self.watch_task.cancel()
+
+    async def watch_inbox(self, inbox):
+        """
+        Daemon mode: runs each workbook dropped into `inbox` as a job, writing its
+        exports and run summary to a folder of its own under jobs/. The browser
+        stays open and signed in between jobs, so a new workbook starts testing
+        within seconds instead of after a browser launch and SSO login.
+        """
+        watcher = InboxWatcher(inbox)
+        poll = float(self.settings.get('inbox_poll_seconds', 2))
+        keepalive = float(self.settings.get('keepalive_minutes', 10)) * 60
+        idle_since = time.monotonic()
+        self.update_log(f"Watching {inbox} for workbooks (put urgent ones in 'high', others in 'low').")
+        try:
+            while self.watching:
+                watcher.scan()
+                job = watcher.next_job()
+                if job is None:
+                    if self.warm_session is not None and time.monotonic() - idle_since >= keepalive:
+                        await self.keep_session_alive()
+                        idle_since = time.monotonic()
+                    self.update_status(f"Watching inbox, {len(watcher.jobs)} job(s) queued")
+                    await asyncio.sleep(poll)
+                    continue
+                priority, input_file = job
+                stem = os.path.splitext(os.path.basename(input_file))[0]
+                job_dir = os.path.join(JOBS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}_{stem}")
+                self.update_log(f"Starting job {stem} ({priority} priority), {len(watcher.jobs)} more queued.")
+                self.is_processing = True
+                self.draining = False
+                self.stop_button.configure(state="normal")
+                self.drain_button.configure(state="normal")
+                task = self.run_task = self.loop.create_task(self.process_asins(input_file, job_dir))
+                task.add_done_callback(self.run_finished)
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    if not task.cancelled():
+                        raise
+                status = 'cancelled' if task.cancelled() else self.run_info.get('status')
+                first_result = None if task.cancelled() else self.run_info.get('first_result_seconds')
+                if status == 'cancelled' and not self.watching:
+                    self.update_log(f"Job {stem} stopped, its workbook stays in the inbox for the next watch.")
+                    break
+                try:
+                    moved = watcher.finish(input_file, status == 'completed')
+                    self.update_log(f"Job {stem} {status}, workbook moved to {os.path.dirname(moved)}.")
+                except OSError as e:
+                    self.update_log(f"Job {stem} {status}, but the workbook could not be moved out of the inbox: {str(e)}")
+                if first_result is not None:
+                    self.update_log(f"Job {stem}: first result after {first_result:.1f} seconds, outputs in {job_dir}.")
+                idle_since = time.monotonic()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.update_log(f"Inbox watch failed: {str(e)}")
+            logging.error(f"Error in watch_inbox: {str(e)}", exc_info=True)
+        finally:
+            self.watching = False
+            await self.close_warm_session()
+            self.watch_task = None
+            self.watch_button.configure(text="Watch Inbox")
+            self.update_status("Ready")
+            self.reset_buttons()
 
     def _run_asyncio_loop(self):
         try:
@@ -619,12 +3516,28 @@ class XCPToolGUI(ctk.CTk):
         self.after(100, self._run_asyncio_loop)
 
     def stop_processing(self):
+        """Cancels the run at whatever step it is in. Exports already downloaded are still collated."""
+        if self.watch_task is not None:
+            self.stop_watching()
         if self.is_processing:
             self.is_processing = False
             self.update_status("Stopping...")
             self.update_log("Stop requested by user")
-            self.start_button.configure(state="normal")
             self.stop_button.configure(state="disabled")
+            self.drain_button.configure(state="disabled")
+            if self.run_task is not None and not self.run_task.done():
+                self.run_task.cancel()
+
+    def drain_processing(self):
+        """Lets the batches under way finish and export, but starts no new ones."""
+        if self.is_processing and not self.draining:
+            self.draining = True
+            self.update_status("Finishing current batch...")
+            self.update_log("Finish requested: no new batches will be started.")
+            self.drain_button.configure(state="disabled")
+            if self.watching:
+                self.watching = False
+                self.update_log("The inbox watch ends after this job.")
 
     def sanitize_excel_column(self, col_name):
         invalid_chars = ['/', '\\', '?', '*', '[', ']', ':', ';', '\n', '\r', '\t', '|']
@@ -641,6 +3554,7 @@ class XCPToolGUI(ctk.CTk):
                 if new_suffix and new_suffix not in self.suffixes:
                     self.suffixes.append(new_suffix)
                     self.update_log(f"Added new suffix: {new_suffix}")
+            self.suffixes_changed()
             if self.suffix_listbox.winfo_ismapped():
                 self.update_suffix_listbox()
         self.suffix_entry.delete(0, tk.END)
@@ -673,73 +3587,113 @@ class XCPToolGUI(ctk.CTk):
                     removed = self.suffixes[idx]
                     del self.suffixes[idx]
                     self.update_log(f"Removed suffix: {removed}")
+                self.suffixes_changed()
                 self.update_suffix_listbox()
         except Exception:
             pass
 
+    def suffixes_changed(self):
+        self.rebuild_suffix_matcher()
+        self.settings['suffixes'] = self.suffixes
+        self.persist_settings()
+
+    def persist_settings(self):
+        try:
+            save_settings(self.settings)
+        except OSError as e:
+            self.update_log(f"Could not save settings: {str(e)}")
+
+    def rebuild_suffix_matcher(self):
+        """
+        Compiles the suffix list into one anchored, case-insensitive alternation.
+        Longest suffixes come first so '_100_keyword' wins over a shorter '_keyword'.
+        """
+        suffixes = sorted({ext for ext in self.suffixes if ext}, key=len, reverse=True)
+        self.suffix_pattern = re.compile('(?:' + '|'.join(map(re.escape, suffixes)) + r')\Z', re.IGNORECASE) if suffixes else None
+
     def clean_class_name(self, class_name):
         """
         Removes known suffix extensions from the end of a class name.
         Extensions are case-insensitive and only removed if at the end.
         """
-        for ext in self.suffixes:
-            if class_name.upper().endswith(ext.upper()):
-                return class_name[: -len(ext)]
-        return class_name
+        if self.suffix_pattern is None:
+            return class_name
+        return self.suffix_pattern.sub('', class_name, count=1)
+
+    def clean_class_names(self, class_names):
+        """
+        Vectorized clean_class_name for a whole pandas Series of class names.
+        """
+        if self.suffix_pattern is None:
+            return class_names
+        return class_names.str.replace(self.suffix_pattern, '', n=1, regex=True)
     async def select_marketplace_dropdown(self, page, marketplace_id):
         """
         Selects marketplace from dropdown by first getting label from marketplace_id,
-        then searching for matching option in dropdown.
+        then clicking the matching option directly.
+        The dropdown options and the option selector resolved for each label are cached
+        for the browser session, and nothing is clicked if the dropdown already shows
+        the target marketplace.
+        Raises StepError if the marketplace cannot be selected, so the batch is never
+        exported with the results of all marketplaces under this marketplace's name.
         """
         # Get marketplace label from id
         label = self.MARKETPLACE_MAP.get(str(marketplace_id).strip().upper())
         if not label:
-            self.update_log(f"Unknown marketplace_id '{marketplace_id}', skipping dropdown selection.")
-            return
+            raise StepError(f"Unknown marketplace_id '{marketplace_id}', cannot select it in the dropdown.")
 
+        cache = self.marketplace_cache
         try:
-            # Find and click dropdown trigger with text "All Marketplaces"
-            self.update_log("Looking for marketplace dropdown trigger...")
-            dropdown_trigger = page.locator('text="All marketplaces"')
-            await dropdown_trigger.wait_for(state="visible", timeout=10000)
-            self.update_log("Found dropdown trigger, scrolling into view...")
-            await dropdown_trigger.scroll_into_view_if_needed()
-            self.update_log("Clicking dropdown trigger...")
-            await dropdown_trigger.click()
-            self.update_log("Clicked marketplace dropdown, waiting for options to load...")
-            await page.wait_for_timeout(3000)
-
-            try:
-                # Get all dropdown options
-                self.update_log("Getting dropdown options...")
-                options = await page.locator('.awsui-select-option').all_text_contents()
-                self.update_log(f"Found {len(options)} dropdown options: {options}")
-
-                # Check if our label exists in options
-                if label not in options:
-                    self.update_log(f"Warning: Label '{label}' not found in dropdown options")
+            resolved = cache['resolved'].get(label, label)
+            default_trigger = page.locator('text="All marketplaces"')
+            selected_trigger = page.locator('.awsui-select-trigger', has=page.get_by_text(resolved, exact=True))
+            await self.timed('marketplace_dropdown', lambda timeout: default_trigger.or_(selected_trigger).first.wait_for(state="visible", timeout=timeout))
+            if await selected_trigger.count() and await selected_trigger.first.is_visible():
+                self.update_log(f"Marketplace dropdown already shows '{resolved}', no change needed.")
+                return
+            await default_trigger.scroll_into_view_if_needed()
+            await default_trigger.click()
+
+            if cache['options'] is None:
+                await self.timed('marketplace_option', lambda timeout: page.locator('.awsui-select-option').first.wait_for(state="visible", timeout=timeout))
+                cache['options'] = [opt.strip() for opt in await page.locator('.awsui-select-option').all_text_contents()]
+                self.update_log(f"Found {len(cache['options'])} dropdown options: {cache['options']}")
+
+            if label not in cache['resolved']:
+                options = cache['options']
+                if label in options:
+                    cache['resolved'][label] = label
+                else:
                     # Try case-insensitive match
                     matching_options = [opt for opt in options if opt.lower() == label.lower()]
                     if matching_options:
-                        self.update_log(f"Found case-insensitive match: {matching_options[0]}")
-                        label = matching_options[0]
+                        self.update_log(f"Found case-insensitive match for '{label}': {matching_options[0]}")
                     else:
-                        self.update_log("No matching option found even with case-insensitive comparison")
-                        return
-
-                # Find and click the option matching our marketplace label using class selector
-                self.update_log(f"Attempting to select option '{label}'...")
-                marketplace_option = page.locator(f'.awsui-select-option:has-text("{label}")')
-                await marketplace_option.wait_for(state="visible", timeout=3000)
-                self.update_log("Found matching option, clicking...")
-                await marketplace_option.click()
-                self.update_log(f"Successfully selected marketplace '{label}' for id '{marketplace_id}'")
-                return
+                        self.update_log(f"Warning: Label '{label}' not found in dropdown options")
+                    cache['resolved'][label] = matching_options[0] if matching_options else None
+                if cache['resolved'][label]:
+                    cache['selectors'][label] = f'.awsui-select-option:has(:text-is("{cache["resolved"][label]}"))'
+            resolved = cache['resolved'][label]
+            if not resolved:
+                await page.keyboard.press('Escape')
+                # Read the options again on the retry, they may not have been complete
+                cache['options'] = None
+                cache['resolved'].pop(label, None)
+                raise StepError(f"Marketplace '{label}' is not in the dropdown.", FAULT_SELECTOR_TIMEOUT)
+
+            marketplace_option = page.locator(cache['selectors'][label]).first
+            await self.timed('marketplace_option', lambda timeout: marketplace_option.click(timeout=timeout))
+            # Wait for the dropdown to show the selection rather than sleeping
+            selected_trigger = page.locator('.awsui-select-trigger', has=page.get_by_text(resolved, exact=True))
+            try:
+                await self.timed('marketplace_option', lambda timeout: selected_trigger.first.wait_for(state="visible", timeout=timeout))
             except Exception as e:
-                self.update_log(f"Error in dropdown option selection: {str(e)}")
+                raise StepError(f"Dropdown does not show '{resolved}' after selection.", FAULT_SELECTOR_TIMEOUT) from e
+            self.update_log(f"Selected marketplace '{resolved}' for id '{marketplace_id}'")
+        except StepError:
+            raise
         except Exception as e:
-            self.update_log(f"Error in marketplace dropdown handling: {str(e)}")
-            self.update_log(f"Stack trace: {e.__traceback__}")
+            raise StepError(f"Could not select marketplace '{label}': {str(e)}", FAULT_SELECTOR_TIMEOUT) from e
    # Add a footer label for tool ownership
     def mainloop(self, *args, **kwargs):
         # Add footer before mainloop
@@ -752,8 +3706,115 @@ class XCPToolGUI(ctk.CTk):
         self.footer_label.place(relx=0.5, rely=0.98, anchor="s")
         super().mainloop(*args, **kwargs)
 
+def run_cli(argv):
+    """
+    Command line entry point, used when the tool is started with arguments:
+        query --asin B0... [--class NAME] [--marketplace US] [--days 30] [--json]
+        startup-benchmark [--runs 5]
+        compare-runs BASELINE_SUMMARY.json CANDIDATE_SUMMARY.json
+        watch [--inbox DIR]
+    """
+    parser = argparse.ArgumentParser(prog="xcp-tool", description="XCP Tool command line")
+    commands = parser.add_subparsers(dest="command", required=True)
+    query = commands.add_parser("query", help="Look up stored results across runs")
+    query.add_argument("--asin")
+    query.add_argument("--class", dest="class_name")
+    query.add_argument("--marketplace", dest="marketplace_id")
+    query.add_argument("--days", type=int, help="Only runs from the last N days")
+    query.add_argument("--limit", type=int, default=200)
+    query.add_argument("--db", default=RESULTS_DB_FILE, help="Results store file")
+    query.add_argument("--json", action="store_true", help="Print rows as JSON")
+    benchmark = commands.add_parser("startup-benchmark", help="Measure time to window and to the first CLI action")
+    benchmark.add_argument("--runs", type=int, default=5)
+    compare = commands.add_parser("compare-runs", help="Compare the step timings of two run summaries")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    watch = commands.add_parser("watch", help="Open the tool watching an inbox folder for workbooks")
+    watch.add_argument("--inbox", help=f"Inbox folder (default {INBOX_DIR})")
+    probe = commands.add_parser("startup-probe")
+    probe.add_argument("kind", choices=["cli", "gui", "imports"])
+    args = parser.parse_args(argv)
+
+    if args.command == "startup-benchmark":
+        return run_startup_benchmark(args.runs)
+    if args.command == "startup-probe":
+        return startup_probe(args.kind)
+    if args.command == "watch":
+        ctk.set_appearance_mode("dark")
+        ctk.set_default_color_theme("blue")
+        app = XCPToolGUI()
+        app.after(0, lambda: app.start_watching(args.inbox))
+        app.mainloop()
+        return 0
+    if args.command == "compare-runs":
+        summaries = []
+        for summary_file in (args.baseline, args.candidate):
+            with open(summary_file, 'r', encoding='utf-8') as f:
+                summaries.append(json.load(f))
+        print("\n".join(compare_run_summaries(*summaries)))
+        return 0
+
+    if args.command == "query":
+        if not os.path.exists(args.db):
+            print(f"No results store found at {args.db}")
+            return 1
+        store = ResultsStore(args.db)
+        try:
+            rows = store.query(args.asin, args.class_name, args.marketplace_id, args.days, args.limit)
+        finally:
+            store.close()
+        print(json.dumps(rows, indent=2) if args.json else format_result_rows(rows))
+    return 0
+
+def startup_probe(kind):
+    """One measured start for startup-benchmark, run in a fresh process."""
+    if kind == "gui":
+        app = XCPToolGUI()
+        app.update()
+        app.destroy()
+    elif kind == "imports":
+        import importlib
+        timings = {}
+        for name in ("pandas", "playwright.async_api", "pyautogui", "nest_asyncio"):
+            started = time.perf_counter()
+            importlib.import_module(name)
+            timings[name] = time.perf_counter() - started
+        print(json.dumps(timings))
+    # "cli" has nothing to do, getting here is the first action
+    return 0
+
+def run_startup_benchmark(runs=5):
+    """
+    Starts the tool `runs` times per probe in fresh processes (the .exe itself when
+    frozen, so unpacking is included) and prints the median and best wall time
+    until the window is drawn and until the command line can act.
+    """
+    import statistics
+    import subprocess
+    command = [sys.executable] if getattr(sys, 'frozen', False) else [sys.executable, os.path.abspath(__file__)]
+    for kind, label in (("cli", "first CLI action"), ("gui", "window")):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = subprocess.run(command + ["startup-probe", kind], capture_output=True, text=True)
+            if result.returncode != 0:
+                error = result.stderr.strip().splitlines()
+                print(f"Time to {label}: probe failed ({error[-1] if error else result.returncode})")
+                break
+            timings.append(time.perf_counter() - started)
+        if timings:
+            print(f"Time to {label}: median {statistics.median(timings) * 1000:.0f} ms, "
+                  f"best {min(timings) * 1000:.0f} ms over {len(timings)} runs")
+    result = subprocess.run(command + ["startup-probe", "imports"], capture_output=True, text=True)
+    if result.returncode == 0 and result.stdout.strip():
+        deferred = json.loads(result.stdout.strip().splitlines()[-1])
+        print("Deferred until a run starts: " + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in deferred.items()))
+    return 0
+
 def main():
     os.environ['PYPPETEER_CHROMIUM_REVISION'] = ''
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     try:
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")